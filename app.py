@@ -1,21 +1,31 @@
-from flask import Flask, request, jsonify, redirect, session, url_for, g
+from flask import Flask, request, jsonify, redirect, session, url_for, g, Response, stream_with_context
 from flask_cors import CORS
 from google_auth_oauthlib.flow import Flow
-from google.oauth2.credentials import Credentials as GoogleCredentials
-from googleapiclient.discovery import build
-import google.auth.transport.requests
 import firebase_admin
 from firebase_admin import credentials as fb_credentials, firestore, auth as firebase_auth
-import threading
 import os
 import json
 
-from agent_core import run_agent_for_user, auth_services
+from agent_core import auth_services
+from agent_scheduler import AgentScheduler
+from agent_bootstrap import resume_in_background, startup_report
+from gmail_watch import decode_push, uid_for_address, verify_push_token
 from calendar_scheduler import schedule_event
 from response_processor import process_replies
-from event_parser import parse_event
+from event_parser import parse_event, get_parse_stats
 from firebase_utils import get_firestore
-from datetime import datetime
+from activity_logger import get_daily_activity, log_user_activity
+from llm_cache import get_cache_stats
+from llm_dispatcher import get_dispatcher_stats
+from freebusy_cache import get_freebusy_stats
+from message_filter import get_filter_stats
+from structured_output import parse_event_output, get_output_stats
+from service_cache import get_services, invalidate as invalidate_services
+from user_repository import user_repository, get_user_repository_stats
+from job_queue import JobQueue, ASYNC_JOBS, FINISHED
+from confirmation_tracker import PENDING_STORE
+from bulk_scheduler import bulk_schedule, read_bulk_items
+from datetime import datetime, timedelta
 # -------------------- FLASK SETUP --------------------
 app = Flask(__name__)
 app.secret_key = "your_super_secret_key_here"
@@ -34,8 +44,22 @@ SCOPES = [
     "https://www.googleapis.com/auth/gmail.readonly"
 ]
 CLIENT_SECRET_FILE = "/etc/secrets/credentials.json"
-background_agents = {}
-agent_flags = {}
+# "inprocess": this process runs agents; "external": src/agent_runner.py does, driven by agentEnabled
+AGENT_RUNNER_MODE = os.environ.get("AGENT_RUNNER_MODE", "inprocess")
+if AGENT_RUNNER_MODE != "inprocess" and PENDING_STORE != "firestore":
+    # The runners' pending proposals must be visible to /check-replies here
+    raise RuntimeError("AGENT_RUNNER_MODE=external needs PENDING_STORE=firestore")
+agent_scheduler = AgentScheduler()
+
+def start_agents():
+    if AGENT_RUNNER_MODE == "inprocess":
+        agent_scheduler.start()
+        resume_in_background(agent_scheduler)
+
+# `python app.py` runs the debug reloader, which imports this module in a watcher process and again in
+# the serving child (WERKZEUG_RUN_MAIN=true); only the serving process may run agents
+if __name__ != "__main__" or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+    start_agents()
 
 # -------------------- HELPERS --------------------
 
@@ -64,26 +88,7 @@ def require_login(f):
     return wrapper
 
 def get_user_services(uid):
-    doc_ref = db.collection("users").document(uid)
-    doc = doc_ref.get()
-    if not doc.exists:
-        raise Exception(f"No stored credentials for uid={uid}")
-    creds_data = doc.to_dict().get("google_creds")
-    if not creds_data:
-        raise Exception("Missing google_creds in Firestore")
-    creds = GoogleCredentials(
-        token=creds_data["token"],
-        refresh_token=creds_data["refresh_token"],
-        token_uri=creds_data["token_uri"],
-        client_id=creds_data["client_id"],
-        client_secret=creds_data["client_secret"],
-        scopes=creds_data["scopes"]
-    )
-    if creds.expired and creds.refresh_token:
-        creds.refresh(google.auth.transport.requests.Request())
-    gmail = build("gmail", "v1", credentials=creds)
-    calendar = build("calendar", "v3", credentials=creds)
-    return gmail, calendar
+    return get_services(uid)
 
 # -------------------- ROUTES --------------------
 
@@ -138,16 +143,15 @@ def home():
 @require_login
 def agent_status():
     uid = g.firebase_uid
-    doc = db.collection("users").document(uid).get()
-    if doc.exists:
-        status = doc.to_dict().get("agentEnabled", False)
+    user = user_repository.get(uid, ["agentEnabled"])
+    if user is not None:
+        status = user.get("agentEnabled", False)
         return jsonify({"running": status}), 200
     return jsonify({"running": False}), 200
 
 @app.route("/toggle-agent", methods=["POST"])
 @require_login
 def toggle_agent():
-    global background_agents, agent_flags
     print("🛠️ /toggle-agent endpoint invoked")
     data = request.get_json()
     enable = data.get("enable", False)
@@ -155,29 +159,96 @@ def toggle_agent():
     print(f"➡️ Toggle request for UID: {uid}, enable={enable}")
     doc_ref = db.collection("users").document(uid)
     doc_ref.set({"agentEnabled": enable}, merge=True)
+    user_repository.note_write(uid, {"agentEnabled": enable})
+
+    if AGENT_RUNNER_MODE != "inprocess":
+        # External runners pick the change up from their agentEnabled listener
+        return jsonify({"uid": uid, "running": enable}), 200
 
     if enable:
-        if uid not in background_agents:
-            print(f"🧵 Spawning thread for UID: {uid}")
-            stop_event = threading.Event()
-            thread = threading.Thread(target=run_agent_for_user, args=(uid, stop_event), daemon=True)
-            background_agents[uid] = thread
-            agent_flags[uid] = stop_event
-            print(f"🧵 Spawning thread for UID: {uid}")
-            thread.start()
+        if agent_scheduler.add_user(uid):
             print(f"✅ Started agent for UID: {uid}")
         else:
             print(f"⚠️ Agent already running for UID: {uid}")
     else:
-        if uid in agent_flags:
-            agent_flags[uid].set()
-            background_agents.pop(uid, None)
-            agent_flags.pop(uid, None)
+        if agent_scheduler.remove_user(uid):
             print(f"🛑 Stopped agent for UID: {uid}")
 
-    print(f"ℹ️ Toggle-agent processed for UID: {uid}, final background_agents={list(background_agents.keys())}")
+    print(f"ℹ️ Toggle-agent processed for UID: {uid}, scheduled agents={len(agent_scheduler.users())}")
     return jsonify({"uid": uid, "running": enable}), 200
 
+@app.route("/agent-metrics")
+@require_login
+def agent_metrics():
+    uid = g.firebase_uid
+    stats = agent_scheduler.user_stats(uid)
+    if stats is None:
+        return jsonify({"running": False}), 200
+    return jsonify({"running": True, **stats}), 200
+
+@app.route("/api/startup-status")
+def startup_status():
+    return jsonify({"mode": AGENT_RUNNER_MODE, **startup_report}), 200
+
+@app.route("/gmail/push", methods=["POST"])
+def gmail_push():
+    """
+    Pub/Sub push endpoint for Gmail watch notifications. Always acks with 204
+    once the payload is understood so Pub/Sub does not redeliver it. Pushes
+    are rejected unless PUBSUB_VERIFICATION_TOKEN is set and matches.
+    """
+    if not verify_push_token(request.args.get("token")):
+        return jsonify({"error": "Invalid push token"}), 403
+    try:
+        payload = decode_push(request.get_json(silent=True))
+    except ValueError as e:
+        print(f"⚠️ Ignoring malformed push: {e}")
+        return "", 204
+
+    uid = uid_for_address(payload["emailAddress"])
+    if uid and AGENT_RUNNER_MODE != "inprocess":
+        # The owning runner sees this change on its users listener and polls right away
+        push_at = {"gmail_push_at": datetime.utcnow().isoformat()}
+        db.collection("users").document(uid).set(push_at, merge=True)
+        user_repository.note_write(uid, push_at)
+        print(f"📬 Push for {uid} (historyId={payload.get('historyId')}), forwarded to runners")
+    elif uid and agent_scheduler.poll_now(uid):
+        print(f"📬 Push for {uid} (historyId={payload.get('historyId')}), sync queued")
+    return "", 204
+
+def run_schedule_job(uid, data):
+    """
+    Parse one email and schedule it. Returns (response body, HTTP status).
+    """
+    gmail, calendar = get_user_services(uid)
+    event_dict = parse_event_output(parse_event(data["email_text"]))
+    if event_dict is None:
+        return {"error": "Could not parse event from model output"}, 422
+    if not event_dict:
+        return {"error": "Missing fields in event"}, 400
+    link = schedule_event(calendar, event_dict, data["sender_email"], gmail, uid=uid)
+    return {"status": "success", "link": link}, 200
+
+def run_check_replies_job(uid, data):
+    gmail, calendar = get_user_services(uid)
+    process_replies(gmail, calendar, uid)
+    return {"status": "Checked replies"}, 200
+
+job_queue = None
+if ASYNC_JOBS:
+    job_queue = JobQueue()
+    job_queue.register("schedule", run_schedule_job)
+    job_queue.register("check_replies", run_check_replies_job)
+    job_queue.start()
+
+def enqueue_job(uid, kind, data):
+    job_id = job_queue.enqueue(uid, kind, data)
+    status_url = url_for("job_status", job_id=job_id)
+    response = jsonify({"job_id": job_id, "status": "queued", "status_url": status_url,
+                        "events_url": url_for("job_events", job_id=job_id)})
+    response.headers["Location"] = status_url
+    return response, 202
+
 @app.route("/schedule", methods=["POST"])
 @require_login
 def schedule():
@@ -188,60 +259,135 @@ def schedule():
         return jsonify({"error": "Missing email_text or sender_email"}), 400
 
     uid = g.firebase_uid
+    job_data = {"email_text": email_text, "sender_email": sender_email}
+    if ASYNC_JOBS:
+        return enqueue_job(uid, "schedule", job_data)
     try:
-        gmail, calendar = get_user_services(uid)
-        parsed = parse_event(email_text)
-        event_dict = json.loads(parsed)
-        if all(k in event_dict for k in ("title", "date", "start", "end")):
-            link = schedule_event(calendar, event_dict, sender_email, gmail)
-            return jsonify({"status": "success", "link": link}), 200
-        else:
-            return jsonify({"error": "Missing fields in event"}), 400
+        body, status = run_schedule_job(uid, job_data)
+        return jsonify(body), status
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/schedule/bulk", methods=["POST"])
+@require_login
+def schedule_bulk():
+    """
+    Backfill many emails at once. Accepts a JSON list, {"emails": [...]} or
+    NDJSON, and streams one NDJSON result line per email as it completes.
+    """
+    try:
+        items = read_bulk_items(request)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    uid = g.firebase_uid
+    try:
+        _, calendar = get_user_services(uid)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+    def stream():
+        counts = {}
+        try:
+            for result in bulk_schedule(calendar, items):
+                counts[result["status"]] = counts.get(result["status"], 0) + 1
+                yield json.dumps(result) + "\n"
+        except Exception as e:
+            print(f"❌ Bulk schedule failed for {uid}: {e}")
+            yield json.dumps({"status": "aborted", "error": str(e)}) + "\n"
+        log_user_activity(uid, "BulkSchedule", f"Imported {len(items)} emails: {counts}")
+
+    return Response(stream_with_context(stream()), mimetype="application/x-ndjson")
+
 @app.route("/check-replies", methods=["POST"])
 @require_login
 def check_replies():
     uid = g.firebase_uid
+    if ASYNC_JOBS:
+        return enqueue_job(uid, "check_replies", {})
     try:
-        gmail, calendar = get_user_services(uid)
-        process_replies(gmail, calendar , uid)
-        return jsonify({"status": "Checked replies"}), 200
+        body, status = run_check_replies_job(uid, {})
+        return jsonify(body), status
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route("/jobs/<job_id>")
+@require_login
+def job_status(job_id):
+    job = job_queue.get(job_id, g.firebase_uid) if job_queue else None
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job), 200
+
+@app.route("/jobs/<job_id>/events")
+@require_login
+def job_events(job_id):
+    """
+    Server-sent events: one `status` event per state change, ending with the finished job.
+    """
+    uid = g.firebase_uid
+    if job_queue is None or job_queue.get(job_id, uid) is None:
+        return jsonify({"error": "Job not found"}), 404
+
+    def stream():
+        last_status = None
+        while True:
+            job = job_queue.get(job_id, uid)
+            if job is None:
+                return
+            if job["status"] != last_status:
+                last_status = job["status"]
+                yield f"event: status\ndata: {json.dumps(job)}\n\n"
+            if job["status"] in FINISHED:
+                return
+            job_queue.wait(1.0)
+
+    return Response(stream_with_context(stream()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @app.route("/user-status")
 def user_status():
     uid = request.args.get("uid")
     if not uid:
         return jsonify({"connected": False, "reason": "Missing UID"}), 400
-    doc = db.collection("users").document(uid).get()
-    if doc.exists and doc.to_dict().get("google_creds"):
+    # Same projection get_user_services reads, so the two share one cached read
+    user = user_repository.get(uid, ["google_creds"])
+    if user is not None and user.get("google_creds"):
         return jsonify({"connected": True}), 200
     return jsonify({"connected": False}), 200
 
 @app.route('/api/activity-stats/<uid>', methods=['GET'])
 def activity_stats(uid):
     try:
-        db = get_firestore()
-        logs = db.collection("users").document(uid).collection("activity_log").stream()
-
-        from collections import Counter
-        from datetime import datetime
-
-        activity_counter = Counter()
-        for log in logs:
-            data = log.to_dict()
-            ts = datetime.fromisoformat(data["timestamp"])
-            key = ts.strftime("%Y-%m-%d")
-            activity_counter[key] += 1
-
-        return jsonify(activity_counter)
+        today = datetime.utcnow().date()
+        date_to = request.args.get("to", today.isoformat())
+        date_from = request.args.get("from", (datetime.fromisoformat(date_to).date() - timedelta(days=29)).isoformat())
+        # Validate YYYY-MM-DD before using the values as a range query
+        datetime.strptime(date_from, "%Y-%m-%d")
+        datetime.strptime(date_to, "%Y-%m-%d")
+
+        totals, by_type = get_daily_activity(uid, date_from, date_to)
+        if request.args.get("by_type"):
+            return jsonify({day: dict(counts) for day, counts in by_type.items()})
+        return jsonify(totals)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid date: {e}"}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+@app.route('/api/parser-stats', methods=['GET'])
+def parser_stats():
+    return jsonify({
+        **get_parse_stats(),
+        "llm_cache": get_cache_stats(),
+        "llm_dispatcher": get_dispatcher_stats(),
+        "freebusy_cache": get_freebusy_stats(),
+        "message_filter": get_filter_stats(),
+        "structured_output": get_output_stats(),
+        "user_documents": get_user_repository_stats()
+    })
+
 @app.route('/api/upcoming-events/<uid>', methods=['GET'])
 def upcoming_events(uid):
     try:
@@ -283,6 +429,8 @@ def store_creds():
             ]
         }
     }, merge=True)
+    user_repository.invalidate(uid)
+    invalidate_services(uid)
 
     return jsonify({"message": "Stored successfully"})
 
@@ -1,17 +1,243 @@
+import atexit
+import os
+import queue
+import threading
+import random
+import time
+from collections import Counter, defaultdict
 from datetime import datetime
+from firebase_admin import firestore
 from firebase_utils import get_firestore
 
+ACTIVITY_LOG_BATCH_SIZE = min(int(os.getenv("ACTIVITY_LOG_BATCH_SIZE", "500")), 500)  # Firestore WriteBatch limit
+ACTIVITY_LOG_FLUSH_INTERVAL = float(os.getenv("ACTIVITY_LOG_FLUSH_INTERVAL", "5"))
+ACTIVITY_LOG_QUEUE_SIZE = int(os.getenv("ACTIVITY_LOG_QUEUE_SIZE", "10000"))
+ACTIVITY_LOG_PUT_TIMEOUT = float(os.getenv("ACTIVITY_LOG_PUT_TIMEOUT", "1"))
+# Daily counters get one write per (uid, day) per flush; raise this only for very hot users
+ACTIVITY_COUNTER_SHARDS = int(os.getenv("ACTIVITY_COUNTER_SHARDS", "1"))
+FIRESTORE_BATCH_LIMIT = 500
+
+
+def _counter_doc_id(day):
+    if ACTIVITY_COUNTER_SHARDS <= 1:
+        return day
+    return f"{day}_{random.randrange(ACTIVITY_COUNTER_SHARDS)}"
+
+
+def _daily_counts(items):
+    """
+    Aggregate entries into {(uid, day): Counter(event_type)}.
+    """
+    counts = defaultdict(Counter)
+    for uid, entry in items:
+        counts[(uid, entry["timestamp"][:10])][entry["event_type"]] += 1
+    return counts
+
+
+def _chunk_for_batch(items):
+    """
+    Split items so each chunk's log writes plus counter writes fit in one WriteBatch.
+    """
+    chunk, days = [], set()
+    for uid, entry in items:
+        key = (uid, entry["timestamp"][:10])
+        if len(chunk) + 1 + len(days | {key}) > FIRESTORE_BATCH_LIMIT:
+            yield chunk
+            chunk, days = [], set()
+        chunk.append((uid, entry))
+        days.add(key)
+    if chunk:
+        yield chunk
+
+
+class ActivityLogSink:
+    """
+    Buffers activity entries in a bounded queue and writes them from a
+    background thread with Firestore WriteBatch, on a size or time threshold.
+    """
+
+    def __init__(self, batch_size=ACTIVITY_LOG_BATCH_SIZE, flush_interval=ACTIVITY_LOG_FLUSH_INTERVAL,
+                 max_queue=ACTIVITY_LOG_QUEUE_SIZE):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._flush_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.written = 0
+        self.dropped = 0
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="activity-log-sink", daemon=True)
+                self._thread.start()
+
+    def put(self, uid, entry):
+        """
+        Enqueue an entry. Blocks briefly when the queue is full (backpressure)
+        and drops the entry if it is still full after ACTIVITY_LOG_PUT_TIMEOUT.
+        """
+        self._ensure_started()
+        try:
+            self._queue.put((uid, entry), timeout=ACTIVITY_LOG_PUT_TIMEOUT)
+        except queue.Full:
+            self.dropped += 1
+            print(f"⚠️ Activity log queue full, dropped entry for {uid}")
+
+    def _drain(self, limit):
+        items = []
+        while len(items) < limit:
+            try:
+                items.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    def _write(self, items):
+        for chunk in _chunk_for_batch(items):
+            try:
+                db = get_firestore()
+                batch = db.batch()
+                for uid, entry in chunk:
+                    ref = db.collection("users").document(uid).collection("activity_log").document()
+                    batch.set(ref, entry)
+                for (uid, day), by_type in _daily_counts(chunk).items():
+                    ref = db.collection("users").document(uid).collection("activity_daily").document(_counter_doc_id(day))
+                    batch.set(ref, {
+                        "date": day,
+                        "total": firestore.Increment(sum(by_type.values())),
+                        "by_type": {t: firestore.Increment(n) for t, n in by_type.items()}
+                    }, merge=True)
+                batch.commit()
+                self.written += len(chunk)
+            except Exception as e:
+                print(f"⚠️ Failed to write {len(chunk)} activity log entries: {e}")
+
+    def flush(self):
+        """
+        Write everything currently queued, one WriteBatch per `batch_size` entries.
+        """
+        with self._flush_lock:
+            while True:
+                items = self._drain(self.batch_size)
+                if not items:
+                    return
+                self._write(items)
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                pending = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            # Keep filling the batch until it is full or the flush interval has passed
+            deadline = time.monotonic() + self.flush_interval
+            while len(pending) < self.batch_size and not self._stop_event.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    pending.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._write(pending)
+        self.flush()
+
+    def shutdown(self, timeout=10):
+        """
+        Stop the background thread after writing any buffered entries.
+        """
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.flush()
+
+    def stats(self):
+        return {"queued": self._queue.qsize(), "written": self.written, "dropped": self.dropped}
+
+
+activity_sink = ActivityLogSink()
+atexit.register(activity_sink.shutdown)
+
+
 def log_user_activity(uid, event_type, details):
     """
-    Logs a user activity with a timestamp into Firestore.
+    Logs a user activity with a timestamp into Firestore via the buffered sink.
     """
-    db = get_firestore()
     try:
         log_entry = {
             "timestamp": datetime.utcnow().isoformat(),
             "event_type": event_type,
             "details": details
         }
-        db.collection("users").document(uid).collection("activity_log").add(log_entry)
+        activity_sink.put(uid, log_entry)
     except Exception as e:
         print(f"⚠️ Failed to log activity for {uid}: {e}")
+
+
+def flush_activity_log():
+    activity_sink.flush()
+
+
+def get_daily_activity(uid, date_from, date_to):
+    """
+    Read per-day totals and per-type counts for [date_from, date_to] (YYYY-MM-DD)
+    from the pre-aggregated counter documents, summing shards.
+    """
+    db = get_firestore()
+    docs = db.collection("users").document(uid).collection("activity_daily") \
+        .where("date", ">=", date_from).where("date", "<=", date_to).stream()
+    totals = Counter()
+    by_type = defaultdict(Counter)
+    for doc in docs:
+        data = doc.to_dict()
+        totals[data["date"]] += data.get("total", 0)
+        by_type[data["date"]].update(data.get("by_type", {}))
+    return totals, by_type
+
+
+def _rebuild_doc_ids(day):
+    """
+    (id to write, ids to delete) so a rebuilt day is counted exactly once across shards.
+    """
+    if ACTIVITY_COUNTER_SHARDS <= 1:
+        return day, []
+    return f"{day}_0", [day] + [f"{day}_{i}" for i in range(1, ACTIVITY_COUNTER_SHARDS)]
+
+
+def rebuild_daily_counters(uid):
+    """
+    One-off backfill: recompute a user's counter documents from the full activity_log.
+    Run it while the user's agent is stopped so live increments are not overwritten.
+    With sharded counters the total goes to shard 0 and the other shards are cleared.
+    """
+    db = get_firestore()
+    counters = db.collection("users").document(uid).collection("activity_daily")
+    entries = [(uid, log.to_dict()) for log in db.collection("users").document(uid).collection("activity_log").stream()]
+    entries = [(u, e) for u, e in entries if "timestamp" in e and "event_type" in e]
+    counts = list(_daily_counts(entries).items())
+    days_per_batch = FIRESTORE_BATCH_LIMIT // max(1, ACTIVITY_COUNTER_SHARDS + (ACTIVITY_COUNTER_SHARDS > 1))
+    for i in range(0, len(counts), days_per_batch):
+        batch = db.batch()
+        for (_, day), types in counts[i:i + days_per_batch]:
+            doc_id, stale_ids = _rebuild_doc_ids(day)
+            batch.set(counters.document(doc_id), {"date": day, "total": sum(types.values()), "by_type": dict(types)})
+            for stale_id in stale_ids:
+                batch.delete(counters.document(stale_id))
+        batch.commit()
+    return len(counts)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Rebuild per-day activity counters from activity_log")
+    parser.add_argument("uids", nargs="*", help="users to rebuild (default: every user)")
+    args = parser.parse_args()
+    uids = args.uids or [ref.id for ref in get_firestore().collection("users").list_documents()]
+    for uid in uids:
+        print(f"📊 Rebuilt {rebuild_daily_counters(uid)} daily counters for {uid}")
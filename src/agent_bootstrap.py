@@ -0,0 +1,120 @@
+import os
+import random
+import threading
+import time
+from firebase_admin import firestore
+from firebase_utils import get_firestore
+from service_cache import preload
+
+RESUME_PAGE_SIZE = int(os.getenv("RESUME_PAGE_SIZE", "500"))
+RESUME_GET_ALL_CHUNK = int(os.getenv("RESUME_GET_ALL_CHUNK", "100"))
+RESUME_STAGGER_WINDOW = float(os.getenv("RESUME_STAGGER_WINDOW", "300"))
+RESUME_HEALTH_TIMEOUT = float(os.getenv("RESUME_HEALTH_TIMEOUT", "3600"))
+
+startup_report = {"state": "idle"}
+
+
+def iter_enabled_uids(db, page_size=RESUME_PAGE_SIZE):
+    """
+    Page through users with agentEnabled == true, fetching document IDs only.
+    """
+    query = db.collection("users").where("agentEnabled", "==", True) \
+        .order_by(firestore.FieldPath.document_id()).select([]).limit(page_size)
+    last = None
+    while True:
+        page = list((query.start_after(last) if last else query).stream())
+        for doc in page:
+            yield doc.id
+        if len(page) < page_size:
+            return
+        last = page[-1]
+
+
+def preload_credentials(db, uids, chunk=RESUME_GET_ALL_CHUNK):
+    """
+    Read google_creds for many users with batched get_all calls and warm the
+    service cache. Returns the UIDs whose services are ready.
+    """
+    ready = []
+    users = db.collection("users")
+    for i in range(0, len(uids), chunk):
+        refs = [users.document(uid) for uid in uids[i:i + chunk]]
+        for doc in db.get_all(refs, field_paths=["google_creds"]):
+            creds_data = (doc.to_dict() or {}).get("google_creds") if doc.exists else None
+            if not creds_data:
+                print(f"⚠️ Skipping resume for {doc.id}: no google_creds")
+                continue
+            try:
+                preload(doc.id, creds_data)
+                ready.append(doc.id)
+            except Exception as e:
+                print(f"⚠️ Skipping resume for {doc.id}: {e}")
+    return ready
+
+
+def _watch_health(scheduler, uids, started):
+    """
+    Record time-to-healthy: when every resumed user has finished a first poll
+    (or has been stopped since).
+    """
+    pending = set(uids)
+    deadline = started + RESUME_HEALTH_TIMEOUT
+    while pending and time.monotonic() < deadline:
+        for uid in list(pending):
+            stats = scheduler.user_stats(uid)
+            if stats is None or stats["cycles"] > 0:
+                pending.discard(uid)
+        time.sleep(1)
+    elapsed = time.monotonic() - started
+    startup_report.update({
+        "state": "healthy" if not pending else "timed_out",
+        "time_to_healthy": elapsed,
+        "unhealthy": len(pending)
+    })
+    print(f"🩺 Agents healthy after {elapsed:.1f}s ({len(uids) - len(pending)}/{len(uids)} users polled)")
+
+
+def resume_enabled_agents(scheduler, owns=None, window=RESUME_STAGGER_WINDOW):
+    """
+    Resume every agentEnabled user on `scheduler` after a restart.
+
+    UIDs come from one paged query, credentials from batched get_all reads,
+    and first polls are spread evenly over `window` seconds (with jitter) so a
+    deploy doesn't hit Gmail/OpenAI quotas all at once. `owns(uid)` limits
+    the set to users this process is responsible for.
+    """
+    started = time.monotonic()
+    startup_report.clear()
+    startup_report.update({"state": "resuming", "started_at": time.time()})
+    db = get_firestore()
+
+    uids = [uid for uid in iter_enabled_uids(db) if owns is None or owns(uid)]
+    ready = preload_credentials(db, uids)
+    slot = window / len(ready) if ready else 0
+    for i, uid in enumerate(ready):
+        scheduler.add_user(uid, delay=i * slot + random.uniform(0, slot))
+
+    startup_report.update({
+        "state": "warming",
+        "enabled": len(uids),
+        "resumed": len(ready),
+        "resume_seconds": time.monotonic() - started,
+        "stagger_window": window
+    })
+    print(f"🔁 Resumed {len(ready)}/{len(uids)} agents in {startup_report['resume_seconds']:.1f}s, "
+          f"first polls spread over {window:.0f}s")
+    threading.Thread(target=_watch_health, args=(scheduler, ready, started), name="agent-health", daemon=True).start()
+    return ready
+
+
+def resume_in_background(scheduler, owns=None):
+    def run():
+        try:
+            resume_enabled_agents(scheduler, owns)
+        except Exception as e:
+            startup_report.update({"state": "failed", "error": str(e)})
+            print(f"❌ Failed to resume agents: {e}")
+
+    thread = threading.Thread(target=run, name="agent-resume", daemon=True)
+    thread.start()
+    return thread
@@ -1,17 +1,18 @@
 import os
-import json
-import time
-import re
-from google.oauth2.credentials import Credentials as GoogleCredentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from email_reader import extract_body
-from event_parser import parse_event
+import threading
+from email_reader import fetch_messages, fetch_metadata, mark_all_as_read
+from message_filter import classify_message
+from gmail_sync import sync_new_message_ids, save_history_id
+from service_cache import get_services
+from event_parser import parse_event, parse_events
+from structured_output import parse_event_output
 from calendar_scheduler import schedule_event
-from response_processor import process_replies
+from response_processor import handle_confirmation_reply
 import firebase_admin
 from firebase_admin import credentials, firestore
 from activity_logger import log_user_activity
+from seen_ids import SeenIds
+from user_repository import user_repository
 
 SCOPES = [
     'https://www.googleapis.com/auth/gmail.modify',
@@ -19,6 +20,12 @@ SCOPES = [
     'https://www.googleapis.com/auth/gmail.send',
     'https://www.googleapis.com/auth/gmail.readonly'
 ]
+# A message that fails to fetch or route this many cycles in a row is given up on (marked read and seen)
+MESSAGE_MAX_ATTEMPTS = int(os.getenv("MESSAGE_MAX_ATTEMPTS", "3"))
+MESSAGE_ATTEMPTS_LIMIT = 10000
+
+_attempts = {}
+_attempts_lock = threading.Lock()
 
 
 def get_firestore():
@@ -50,200 +57,173 @@ def get_firestore():
 #     return gmail_service, calendar_service
 
 def auth_services(uid):
-    db = get_firestore()
-    doc_ref = db.collection("users").document(uid)
-    doc = doc_ref.get()
-    if not doc.exists:
-        raise Exception(f"No stored credentials for uid={uid}")
-
-    creds_data = doc.to_dict().get("google_creds", {})
-    
-    # ✅ Support both new (access_token) and legacy (token) field
-    token = creds_data.get("access_token") or creds_data.get("token")
-    if not token:
-        raise Exception(f"Missing access token for uid={uid}")
-
-    refresh_token = creds_data.get("refresh_token")
-    client_id = creds_data.get("client_id") or os.environ.get("GOOGLE_CLIENT_ID")
-    client_secret = creds_data.get("client_secret") or os.environ.get("GOOGLE_CLIENT_SECRET")
-    token_uri = creds_data.get("token_uri", "https://oauth2.googleapis.com/token")
-    scopes = creds_data.get("scopes") or [
-        "https://www.googleapis.com/auth/gmail.modify",
-        "https://www.googleapis.com/auth/calendar",
-        "https://www.googleapis.com/auth/gmail.send",
-        "https://www.googleapis.com/auth/gmail.readonly"
-    ]
-
-    creds = GoogleCredentials(
-        token=token,
-        refresh_token=refresh_token,
-        token_uri=token_uri,
-        client_id=client_id,
-        client_secret=client_secret,
-        scopes=scopes
-    )
-
-    
-
-    gmail = build("gmail", "v1", credentials=creds)
-    calendar = build("calendar", "v3", credentials=creds)
-    return gmail, calendar
-
-def extract_sender_email(headers):
-    sender = next((h['value'] for h in headers if h['name'].lower() == 'from'), None)
-    if sender:
-        match = re.search(r'<(.+?)>', sender)
-        return match.group(1) if match else sender
-    return None
+    """
+    Return (gmail, calendar) services for a user from the process-wide cache.
+    """
+    return get_services(uid)
+
+def _seen_ids_ref(db, uid):
+    return db.collection("users").document(uid).collection("agent_state").document("seen_ids")
 
 def load_seen_ids(uid):
     """
     Load the seen message IDs for a specific user from Firestore.
+    Falls back to the legacy list inside google_creds, which is migrated on the next save.
     """
     db = get_firestore()
     try:
-        doc = db.collection("users").document(uid).get()
+        doc = _seen_ids_ref(db, uid).get()
         if doc.exists:
-            seen_ids = doc.to_dict().get("google_creds", {}).get("seen_ids", [])
-            return set(seen_ids)
+            return SeenIds(doc.to_dict().get("ids", []))
+        user = user_repository.get(uid, ["google_creds.seen_ids"])
+        if user is not None:
+            legacy_ids = user.get("google_creds", {}).get("seen_ids")
+            if legacy_ids:
+                seen_ids = SeenIds(legacy_ids)
+                seen_ids.dirty = True
+                seen_ids.legacy = True
+                return seen_ids
     except Exception as e:
         print(f"⚠️ Failed to load seen_ids for UID {uid}: {e}")
-    return set()
+    return SeenIds()
 
-def save_seen_ids(uid, seen_ids_set):
+def save_seen_ids(uid, seen_ids):
     """
-    Save updated seen message IDs for the user back to Firestore without overwriting other google_creds fields.
+    Persist seen message IDs to users/{uid}/agent_state/seen_ids, only when they changed.
     """
+    if not seen_ids.dirty:
+        return
     db = get_firestore()
     try:
-        doc_ref = db.collection("users").document(uid)
-        doc_ref.update({
-            "google_creds.seen_ids": list(seen_ids_set)
-        })
+        _seen_ids_ref(db, uid).set({"ids": seen_ids.to_list()})
+        if seen_ids.legacy:
+            db.collection("users").document(uid).update({"google_creds.seen_ids": firestore.DELETE_FIELD})
+            user_repository.invalidate(uid)
+            seen_ids.legacy = False
+        seen_ids.dirty = False
     except Exception as e:
         print(f"⚠️ Failed to save seen_ids for UID {uid}: {e}")
 
-def user_agent_loop(uid, gmail, calendar):
-    seen_ids = load_seen_ids(uid)
-    print(f"🤖 Agent started for user: {uid}")
-
-    stop_event = agent_flags.get(uid)
-    if stop_event is None:
-        stop_event = threading.Event()
-        agent_flags[uid] = stop_event
-
-    while not stop_event.is_set():
+def handle_event_email(uid, gmail, calendar, sender_email, email_text, parsed=None):
+    """
+    New-event path: ask GPT for event details (unless already parsed in a batch) and schedule them.
+    """
+    print(f"\n📧 From: {sender_email}\n📨 Email: {email_text[:200]}...")
+    log_user_activity(uid, "EmailProcessed", f"Parsed subject from {sender_email}")
+    if parsed is None:
         try:
-            results = gmail.users().messages().list(
-                userId='me', labelIds=['INBOX'], q="is:unread", maxResults=5
-            ).execute()
-            messages = results.get('messages', [])
-
-            if not messages:
-                print("📭 No unread messages.")
-            else:
-                for msg in messages:
-                    msg_id = msg['id']
-                    if msg_id in seen_ids:
-                        continue
-
-                    seen_ids.add(msg_id)
-                    full_msg = gmail.users().messages().get(
-                        userId='me', id=msg_id, format='full'
-                    ).execute()
-                    payload = full_msg.get("payload", {})
-                    email_text = extract_body(payload)
-                    sender_email = extract_sender_email(payload.get("headers", []))
-
-                    print(f"\n📧 From: {sender_email}\n📨 Email: {email_text[:200]}...")
-                    log_user_activity(uid, "EmailProcessed", f"Parsed subject from {sender_email}")
-                    parsed = parse_event(email_text)
-                    print("🤖 GPT:", parsed)
-
-                    try:
-                        event_dict = json.loads(parsed)
-                        if all(k in event_dict for k in ("title", "date", "start", "end")):
-                            link = schedule_event(calendar, event_dict, sender_email, gmail)
-                            print("✅ Event scheduled:", link)
-                        else:
-                            print("⚠️ Missing required fields.")
-                    except json.JSONDecodeError:
-                        print("⚠️ GPT output is not valid JSON.")
-                    except Exception as e:
-                        print("❌ Scheduling error:", e)
-
-            # Trim seen_ids to last 500
-            if len(seen_ids) > 500:
-                seen_ids = set(list(seen_ids)[-500:])
-            save_seen_ids(uid, seen_ids)
-
-            process_replies(gmail, calendar,uid)
-
+            parsed = parse_event(email_text)
         except Exception as e:
-            print("❌ Agent loop error:", e)
-
-        time.sleep(60)
-
-    print(f"👋 Agent thread stopped for user {uid}")
-
-def run_agent_for_user(uid, stop_event):
-    print(f"🚀 run_agent_for_user() called for UID: {uid}")
+            print(f"❌ Event extraction failed for {sender_email}: {e}")
+            return
+    print("🤖 GPT:", parsed)
+
+    event_dict = parse_event_output(parsed)
+    if event_dict is None:
+        print("⚠️ GPT output is not valid event JSON.")
+        return
+    if not event_dict:
+        print("⚠️ Missing required fields.")
+        return
     try:
-        gmail, calendar = auth_services(uid)
-        seen_ids = load_seen_ids(uid)
-        print(f"🤖 Background agent thread started for {uid}")
+        link = schedule_event(calendar, event_dict, sender_email, gmail, uid=uid)
+        print("✅ Event scheduled:", link)
+        log_user_activity(uid, "EventScheduled", f"Scheduled '{event_dict['title']}' on {event_dict['date']} at {event_dict['start']}")
     except Exception as e:
-        print(f"❌ Agent failed to start for {uid}: {e}")
-        return  # Exit the thread
-
-    while not stop_event.is_set():
-        try:
-            results = gmail.users().messages().list(
-                userId='me', labelIds=['INBOX'], q="is:unread", maxResults=5
-            ).execute()
-            messages = results.get('messages', [])
-
-            for msg in messages:
-                msg_id = msg['id']
-                if msg_id in seen_ids:
-                    continue
-
-                seen_ids.add(msg_id)
-                full_msg = gmail.users().messages().get(
-                    userId='me', id=msg_id, format='full'
-                ).execute()
-                payload = full_msg.get("payload", {})
-                email_text = extract_body(payload)
-                sender_email = extract_sender_email(payload.get("headers", []))
-
-                print(f"\n📧 From: {sender_email}\n📨 Email: {email_text[:200]}...")
-                log_user_activity(uid, "EmailProcessed", f"Parsed subject from {sender_email}")
-                parsed = parse_event(email_text)
-                print("🤖 GPT:", parsed)
-
-                try:
-                    event_dict = json.loads(parsed)
-                    if all(k in event_dict for k in ("title", "date", "start", "end")):
-                        link = schedule_event(calendar, event_dict, sender_email, gmail)
-                        print("✅ Event scheduled:", link)
-                        log_user_activity(uid, "EventScheduled", f"Scheduled '{event_dict['title']}' on {event_dict['date']} at {event_dict['start']}")
-                    else:
-                        print("⚠️ Missing required fields.")
-                except json.JSONDecodeError:
-                    print("⚠️ GPT output is not valid JSON.")
-                except Exception as e:
-                    print("❌ Scheduling error:", e)
-
-            # Trim seen_ids to last 500
-            if len(seen_ids) > 500:
-                seen_ids = set(list(seen_ids)[-500:])
-            save_seen_ids(uid, seen_ids)
-
-            process_replies(gmail, calendar,uid)
+        print("❌ Scheduling error:", e)
 
-        except Exception as e:
-            print("❌ Agent run error:", e)
-
-        time.sleep(60)
+def route_message(uid, gmail, calendar, message, pending=None, parsed=None):
+    """
+    Send a fetched message to the reply-confirmation path if its sender has a
+    pending proposal, otherwise to the new-event path.
+    """
+    if pending:
+        handle_confirmation_reply(gmail, calendar, uid, message["sender_email"], message["body"], pending)
+    else:
+        handle_event_email(uid, gmail, calendar, message["sender_email"], message["body"], parsed)
 
-    print(f"👋 Agent thread stopped for user {uid}")
+def _record_failure(uid, msg_id):
+    """
+    Count a failed attempt at a message. Returns True once it has failed MESSAGE_MAX_ATTEMPTS times.
+    """
+    key = (uid, msg_id)
+    with _attempts_lock:
+        if key not in _attempts and len(_attempts) >= MESSAGE_ATTEMPTS_LIMIT:
+            _attempts.clear()
+        _attempts[key] = _attempts.get(key, 0) + 1
+        if _attempts[key] < MESSAGE_MAX_ATTEMPTS:
+            return False
+        del _attempts[key]
+        return True
+
+def _clear_failures(uid, msg_ids):
+    with _attempts_lock:
+        for msg_id in msg_ids:
+            _attempts.pop((uid, msg_id), None)
+
+def run_agent_cycle(uid, gmail, calendar, seen_ids):
+    """
+    Run one poll cycle for a user: fetch only the headers of each new unread
+    email, drop bulk/irrelevant mail, batch-fetch the full body of the rest,
+    extract events for them in one batched LLM call, route them, then mark
+    the handled ones read. `seen_ids` is updated in place.
+
+    Each message is handled on its own: one that could not be fetched or
+    whose handler raised stays unread and out of `seen_ids`, and the Gmail
+    history cursor holds so it comes back next cycle. After
+    MESSAGE_MAX_ATTEMPTS failures it is treated as handled so the cursor can
+    move. Returns the number of new messages handled.
+    """
+    synced_ids, history_id = sync_new_message_ids(gmail, uid)
+    new_ids = [msg_id for msg_id in synced_ids if msg_id not in seen_ids]
+    handled = []
+    failed = []
+    try:
+        metas = fetch_metadata(gmail, new_ids)
+        fetched_ids = {meta["id"] for meta in metas}
+        failed.extend(msg_id for msg_id in new_ids if msg_id not in fetched_ids)
+        pending_by_id = {}
+        for meta in metas:
+            route, detail = classify_message(uid, meta)
+            if route == "skip":
+                print(f"⏭️ Skipping {meta['id']} from {meta['sender_email']} ({detail})")
+                handled.append(meta["id"])
+                continue
+            pending_by_id[meta["id"]] = detail
+
+        messages = fetch_messages(gmail, list(pending_by_id))
+        fetched_ids = {message["id"] for message in messages}
+        failed.extend(msg_id for msg_id in pending_by_id if msg_id not in fetched_ids)
+        # One batched extraction for every new-event candidate in this cycle
+        parsed_by_id = parse_events([(m["id"], m["body"]) for m in messages if not pending_by_id[m["id"]]])
+        for message in messages:
+            try:
+                route_message(uid, gmail, calendar, message, pending_by_id[message["id"]],
+                              parsed_by_id.get(message["id"]))
+            except Exception as e:
+                print(f"❌ Failed to handle message {message['id']} for {uid}: {e}")
+                failed.append(message["id"])
+                continue
+            handled.append(message["id"])
+
+        _clear_failures(uid, handled)
+        for msg_id in failed:
+            if _record_failure(uid, msg_id):
+                print(f"⚠️ Giving up on message {msg_id} for {uid} after {MESSAGE_MAX_ATTEMPTS} attempts")
+                handled.append(msg_id)
+        if handled:
+            mark_all_as_read(gmail, handled)
+    except Exception:
+        if handled:
+            try:
+                mark_all_as_read(gmail, handled)
+            except Exception as e:
+                print(f"⚠️ Failed to mark handled messages read for {uid}: {e}")
+        raise
+    finally:
+        seen_ids.update(handled)
+        save_seen_ids(uid, seen_ids)
+
+    if history_id and len(handled) == len(new_ids):
+        save_history_id(uid, history_id)
+    return len(handled)
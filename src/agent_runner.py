@@ -0,0 +1,256 @@
+"""
+Standalone agent runner, separate from the Flask app.
+
+    PYTHONPATH=src python src/agent_runner.py [--processes N]
+
+Users are hashed into RUNNER_SHARDS shards. Every runner process
+heartbeats a document in `agent_runners`, picks the shards that
+rendezvous-hash to it among the live runners and drives their users only
+while it holds the shard's lease in `agent_shards` (claimed in a
+transaction, renewed on every heartbeat, expiring after RUNNER_TTL). There
+is no leader: when a runner joins or stops heartbeating, every runner
+recomputes its shards; a shard moves once its old holder releases it or its
+lease expires, so two runners never drive one user. A runner that cannot
+renew its leases pauses its users before they expire. Each runner drives
+its users on its own AgentScheduler.
+"""
+import argparse
+import hashlib
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import time
+from firebase_admin import firestore
+from firebase_utils import get_firestore
+from confirmation_tracker import PENDING_STORE
+from agent_scheduler import AgentScheduler
+from agent_bootstrap import resume_enabled_agents
+
+RUNNER_HEARTBEAT_INTERVAL = float(os.getenv("RUNNER_HEARTBEAT_INTERVAL", "10"))
+RUNNER_TTL = float(os.getenv("RUNNER_TTL", "30"))
+RUNNER_SHARDS = int(os.getenv("RUNNER_SHARDS", "32"))
+RUNNERS_COLLECTION = "agent_runners"
+SHARDS_COLLECTION = "agent_shards"
+
+
+def _score(runner_id, uid):
+    return hashlib.sha1(f"{runner_id}:{uid}".encode("utf-8")).hexdigest()
+
+
+def owner_for(uid, runner_ids):
+    """
+    Rendezvous (highest random weight) hashing: the live runner with the top
+    score for this UID owns it.
+    """
+    return max(runner_ids, key=lambda runner_id: _score(runner_id, uid)) if runner_ids else None
+
+
+def shard_for(uid):
+    return int(_score("shard", uid), 16) % RUNNER_SHARDS
+
+
+class AgentRunner:
+    def __init__(self, runner_id=None, scheduler=None):
+        self.runner_id = runner_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.scheduler = scheduler or AgentScheduler()
+        self.stop_event = threading.Event()
+        self._lock = threading.Lock()
+        self._enabled = {}  # uid -> last gmail_push_at seen
+        self._members = [self.runner_id]
+        self._shards = set()  # shards whose lease this runner holds
+        self._lease_renewed_at = 0.0  # monotonic time the held leases were last renewed
+        self._watch = None
+
+    # ---- membership ----
+
+    def heartbeat(self):
+        get_firestore().collection(RUNNERS_COLLECTION).document(self.runner_id).set({
+            "host": socket.gethostname(),
+            "pid": os.getpid(),
+            "last_seen": time.time()
+        })
+
+    def live_members(self):
+        cutoff = time.time() - RUNNER_TTL
+        docs = get_firestore().collection(RUNNERS_COLLECTION).where("last_seen", ">", cutoff).stream()
+        members = sorted(doc.id for doc in docs)
+        if self.runner_id not in members:
+            members.append(self.runner_id)
+        return members
+
+    def owns(self, uid):
+        return shard_for(uid) in self._shards
+
+    # ---- shard leases ----
+
+    def _update_lease(self, shard, release=False):
+        """
+        Claim or renew (or, with `release`, give up) a shard lease in a
+        transaction. Returns True if this runner holds the lease afterwards.
+        """
+        db = get_firestore()
+        ref = db.collection(SHARDS_COLLECTION).document(str(shard))
+        now = time.time()
+
+        @firestore.transactional
+        def update(transaction):
+            snapshot = ref.get(transaction=transaction)
+            lease = (snapshot.to_dict() or {}) if snapshot.exists else {}
+            mine = lease.get("owner") == self.runner_id
+            if release:
+                if mine:
+                    transaction.delete(ref)
+                return False
+            if not mine and lease.get("expires_at", 0) > now:
+                return False
+            transaction.set(ref, {"owner": self.runner_id, "expires_at": now + RUNNER_TTL})
+            return True
+
+        return update(db.transaction())
+
+    def _sync_users(self):
+        owned = {uid for uid in self._enabled if self.owns(uid)}
+        for uid in self.scheduler.users():
+            if uid not in owned:
+                self.scheduler.remove_user(uid)
+        for uid in owned:
+            self.scheduler.add_user(uid)
+
+    def pause_if_lease_stale(self):
+        """
+        Drop every owned user when the leases could expire before the next
+        renewal, so another runner can take the shards over without overlap.
+        """
+        age = time.monotonic() - self._lease_renewed_at
+        if not self._shards or age + RUNNER_HEARTBEAT_INTERVAL < RUNNER_TTL:
+            return
+        print(f"⏸️ Runner {self.runner_id}: leases not renewed for {age:.0f}s, pausing its users")
+        with self._lock:
+            self._shards = set()
+            self._sync_users()
+
+    # ---- user set ----
+
+    def _on_users_snapshot(self, docs, changes, read_time):
+        with self._lock:
+            for change in changes:
+                doc = change.document
+                if change.type.name == "REMOVED":
+                    self._enabled.pop(doc.id, None)
+                    self.scheduler.remove_user(doc.id)
+                    continue
+                push_at = (doc.to_dict() or {}).get("gmail_push_at")
+                known = doc.id in self._enabled
+                previous = self._enabled.get(doc.id)
+                self._enabled[doc.id] = push_at
+                if not self.owns(doc.id):
+                    continue
+                if self.scheduler.add_user(doc.id):
+                    print(f"✅ Runner {self.runner_id} picked up {doc.id}")
+                elif known and push_at and push_at != previous:
+                    self.scheduler.poll_now(doc.id)
+
+    def rebalance(self):
+        """
+        Heartbeat, release the shards that now belong to another live runner,
+        claim or renew the ones that belong here, and start/stop users to match.
+        """
+        self.heartbeat()
+        members = self.live_members()
+        wanted = {shard for shard in range(RUNNER_SHARDS) if owner_for(f"shard-{shard}", members) == self.runner_id}
+        with self._lock:
+            if members != self._members:
+                print(f"🔀 Runner {self.runner_id}: members {self._members} -> {members}")
+            self._members = members
+            released = self._shards - wanted
+            # Stop the users before giving their leases away
+            self._shards -= released
+            self._sync_users()
+        for shard in released:
+            self._update_lease(shard, release=True)
+
+        renewed_at = time.monotonic()
+        held = {shard for shard in wanted if self._update_lease(shard)}
+        with self._lock:
+            self._shards = held
+            self._lease_renewed_at = renewed_at
+            self._sync_users()
+
+    # ---- lifecycle ----
+
+    def run(self):
+        self.scheduler.start()
+        # Only resume users whose shard leases are held; shards still leased elsewhere follow on later rebalances
+        self.rebalance()
+        # Bulk, staggered resume first; the listener then only adds users toggled on later
+        resume_enabled_agents(self.scheduler, owns=self.owns)
+        query = get_firestore().collection("users").where("agentEnabled", "==", True)
+        self._watch = query.on_snapshot(self._on_users_snapshot)
+        print(f"🏃 Agent runner {self.runner_id} started")
+        try:
+            while not self.stop_event.wait(RUNNER_HEARTBEAT_INTERVAL):
+                try:
+                    self.heartbeat()
+                    self.rebalance()
+                except Exception as e:
+                    print(f"⚠️ Runner {self.runner_id} heartbeat failed: {e}")
+                    self.pause_if_lease_stale()
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        if self._watch is not None:
+            self._watch.unsubscribe()
+            self._watch = None
+        self.scheduler.stop(timeout=30)
+        try:
+            # Leave promptly so the other runners take over without waiting for RUNNER_TTL
+            for shard in self._shards:
+                self._update_lease(shard, release=True)
+            self._shards = set()
+            get_firestore().collection(RUNNERS_COLLECTION).document(self.runner_id).delete()
+        except Exception as e:
+            print(f"⚠️ Failed to deregister runner {self.runner_id}: {e}")
+        print(f"👋 Agent runner {self.runner_id} stopped")
+
+
+def run_runner():
+    runner = AgentRunner()
+    signal.signal(signal.SIGTERM, lambda *_: runner.stop_event.set())
+    signal.signal(signal.SIGINT, lambda *_: runner.stop_event.set())
+    runner.run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run user agents outside the Flask app.")
+    parser.add_argument("--processes", type=int, default=int(os.getenv("AGENT_RUNNER_PROCESSES", "1")),
+                        help="runner processes to start on this machine")
+    args = parser.parse_args()
+    if PENDING_STORE != "firestore":
+        # Runners and the Flask app's /check-replies must see the same pending proposals
+        raise SystemExit("agent_runner needs PENDING_STORE=firestore; the SQLite store is local to one host")
+
+    if args.processes <= 1:
+        run_runner()
+        return
+
+    # spawn, not fork: the Firestore/gRPC clients are not fork-safe
+    ctx = multiprocessing.get_context("spawn")
+    processes = [ctx.Process(target=run_runner, name=f"agent-runner-{i}") for i in range(args.processes)]
+    for process in processes:
+        process.start()
+
+    def stop_all(*_):
+        for process in processes:
+            process.terminate()
+
+    signal.signal(signal.SIGTERM, stop_all)
+    signal.signal(signal.SIGINT, stop_all)
+    for process in processes:
+        process.join()
+
+
+if __name__ == "__main__":
+    main()
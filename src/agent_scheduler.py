@@ -0,0 +1,238 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+
+from agent_core import auth_services, load_seen_ids, run_agent_cycle
+from activity_logger import flush_activity_log
+from poll_interval import AdaptiveInterval, POLL_INTERVAL
+from gmail_watch import ensure_watch
+from user_repository import user_repository
+
+AGENT_WORKERS = int(os.getenv("AGENT_WORKERS", "8"))
+# With a Gmail push watch active, polling is only a safety net
+PUSH_SAFETY_POLL_INTERVAL = float(os.getenv("PUSH_SAFETY_POLL_INTERVAL", "1800"))
+
+
+class UserAgentState:
+    """
+    Per-user bookkeeping for the shared scheduler: services, seen IDs,
+    cancellation flag and poll latency stats.
+    """
+
+    def __init__(self, uid, poll_interval=POLL_INTERVAL):
+        self.uid = uid
+        self.stop_event = threading.Event()
+        self.interval = AdaptiveInterval(poll_interval)
+        self.watch_expiration = None
+        self.in_flight = False
+        self.poll_requested = False
+        self.push_polls = 0
+        self.gmail = None
+        self.calendar = None
+        self.seen_ids = None
+        self.next_due = 0.0
+        self.cycles = 0
+        self.errors = 0
+        self.last_latency = None
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.last_poll_at = None
+
+    def record_latency(self, seconds):
+        self.cycles += 1
+        self.last_latency = seconds
+        self.total_latency += seconds
+        self.max_latency = max(self.max_latency, seconds)
+        self.last_poll_at = time.time()
+
+    def stats(self):
+        return {
+            "uid": self.uid,
+            "cycles": self.cycles,
+            "errors": self.errors,
+            "last_latency": self.last_latency,
+            "avg_latency": self.total_latency / self.cycles if self.cycles else None,
+            "max_latency": self.max_latency,
+            "poll_interval": self.interval.current,
+            "push_active": self.watch_expiration is not None,
+            "push_polls": self.push_polls,
+            "last_poll_at": self.last_poll_at,
+            "next_due_in": max(0.0, self.next_due - time.monotonic()),
+        }
+
+
+class AgentScheduler:
+    """
+    Runs poll cycles for many users on a fixed pool of worker threads.
+
+    Users are kept in a min-heap ordered by their next poll deadline, so the
+    number of threads depends on `num_workers`, not on the number of users.
+    Each user's next deadline comes from an AdaptiveInterval.
+    """
+
+    def __init__(self, num_workers=AGENT_WORKERS, poll_interval=POLL_INTERVAL):
+        self.num_workers = num_workers
+        self.poll_interval = poll_interval
+        self._heap = []
+        self._seq = itertools.count()
+        self._users = {}
+        self._cond = threading.Condition()
+        self._stop_event = threading.Event()
+        self._workers = []
+
+    def start(self):
+        if self._workers:
+            return
+        for i in range(self.num_workers):
+            worker = threading.Thread(target=self._worker_loop, name=f"agent-worker-{i}", daemon=True)
+            self._workers.append(worker)
+            worker.start()
+        print(f"🧵 Agent scheduler started with {self.num_workers} workers")
+
+    def stop(self, timeout=None):
+        self._stop_event.set()
+        with self._cond:
+            for state in self._users.values():
+                state.stop_event.set()
+            self._users.clear()
+            self._cond.notify_all()
+        for worker in self._workers:
+            worker.join(timeout)
+        self._workers = []
+        flush_activity_log()
+        print("🛑 Agent scheduler stopped")
+
+    def add_user(self, uid, delay=0.0):
+        """
+        Schedule a user's first poll `delay` seconds from now.
+        Returns False if the user is already scheduled.
+        """
+        with self._cond:
+            if uid in self._users:
+                return False
+            state = UserAgentState(uid, self.poll_interval)
+            self._users[uid] = state
+            self._push(state, time.monotonic() + delay)
+        # Polled users re-read their document every cycle; keep it cached via a listener
+        user_repository.watch(uid)
+        return True
+
+    def remove_user(self, uid):
+        """
+        Cancel a user's agent. An in-flight cycle finishes but is not rescheduled.
+        """
+        with self._cond:
+            state = self._users.pop(uid, None)
+            if state is None:
+                return False
+            state.stop_event.set()
+            self._cond.notify_all()
+        user_repository.unwatch(uid)
+        return True
+
+    def poll_now(self, uid):
+        """
+        Move a user's next poll to now, e.g. on a Gmail push notification.
+        If a cycle is already running, another one follows right after it.
+        """
+        with self._cond:
+            state = self._users.get(uid)
+            if state is None:
+                return False
+            state.push_polls += 1
+            if state.in_flight:
+                state.poll_requested = True
+            else:
+                self._push(state, time.monotonic())
+            return True
+
+    def is_running(self, uid):
+        with self._cond:
+            return uid in self._users
+
+    def users(self):
+        with self._cond:
+            return list(self._users.keys())
+
+    def user_stats(self, uid):
+        with self._cond:
+            state = self._users.get(uid)
+            return state.stats() if state else None
+
+    def stats(self):
+        with self._cond:
+            return {
+                "workers": self.num_workers,
+                "users": len(self._users),
+                "queued": len(self._heap),
+                "per_user": {uid: state.stats() for uid, state in self._users.items()},
+            }
+
+    def _push(self, state, due):
+        state.next_due = due
+        heapq.heappush(self._heap, (due, next(self._seq), state))
+        self._cond.notify()
+
+    def _next_due_state(self):
+        """
+        Block until a user's deadline has passed and return its state,
+        or None when the scheduler is stopping.
+        """
+        with self._cond:
+            while not self._stop_event.is_set():
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                due, _, state = self._heap[0]
+                wait = due - time.monotonic()
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+                heapq.heappop(self._heap)
+                # Skip stale entries left behind by remove_user() and poll_now()
+                if state.stop_event.is_set() or state.next_due != due or state.in_flight:
+                    continue
+                state.in_flight = True
+                return state
+        return None
+
+    def _run_cycle(self, state):
+        # Services come from the process-wide cache, so this is cheap after the first cycle
+        state.gmail, state.calendar = auth_services(state.uid)
+        if state.seen_ids is None:
+            state.seen_ids = load_seen_ids(state.uid)
+            print(f"🤖 Agent initialised for {state.uid}")
+        state.watch_expiration = ensure_watch(state.gmail, state.uid, state.watch_expiration)
+        return run_agent_cycle(state.uid, state.gmail, state.calendar, state.seen_ids)
+
+    def _worker_loop(self):
+        while True:
+            state = self._next_due_state()
+            if state is None:
+                return
+
+            started = time.monotonic()
+            processed = 0
+            try:
+                processed = self._run_cycle(state)
+            except Exception as e:
+                state.errors += 1
+                print(f"❌ Agent run error for {state.uid}: {e}")
+            state.record_latency(time.monotonic() - started)
+            delay = state.interval.next_delay(processed > 0)
+            if state.watch_expiration is not None:
+                delay = PUSH_SAFETY_POLL_INTERVAL
+
+            with self._cond:
+                state.in_flight = False
+                stopped = state.stop_event.is_set()
+                if not stopped:
+                    if state.poll_requested:
+                        state.poll_requested = False
+                        delay = 0
+                    self._push(state, time.monotonic() + delay)
+            if stopped:
+                # The user was toggled off mid-cycle; don't leave their entries buffered
+                flush_activity_log()
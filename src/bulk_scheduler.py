@@ -0,0 +1,123 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from event_parser import parse_event
+from structured_output import parse_event_output
+from calendar_scheduler import TIMEZONE, to_local_datetime
+from slot_finder import fetch_busy_index
+from freebusy_cache import invalidate as invalidate_freebusy
+from email_reader import BATCH_SIZE
+
+BULK_SCHEDULE_MAX_ITEMS = int(os.getenv("BULK_SCHEDULE_MAX_ITEMS", "1000"))
+BULK_PARSE_CONCURRENCY = int(os.getenv("BULK_PARSE_CONCURRENCY", "8"))
+
+
+def read_bulk_items(request):
+    """
+    Accept a JSON list, {"emails": [...]}, or an NDJSON body (one email object per line).
+    Raises ValueError for a malformed or oversized body.
+    """
+    if request.mimetype in ("application/x-ndjson", "application/jsonl"):
+        items = [json.loads(line) for line in request.get_data(as_text=True).splitlines() if line.strip()]
+    else:
+        data = request.get_json(silent=True)
+        items = data.get("emails") if isinstance(data, dict) else data
+    if not isinstance(items, list):
+        raise ValueError("Expected a list of emails")
+    if len(items) > BULK_SCHEDULE_MAX_ITEMS:
+        raise ValueError(f"At most {BULK_SCHEDULE_MAX_ITEMS} emails per request")
+    return items
+
+
+def _parse_item(item):
+    event = parse_event_output(parse_event(item["email_text"]))
+    if event is None:
+        raise ValueError("Could not parse event from model output")
+    return event
+
+
+def _overlaps(start, end, intervals):
+    return any(s < end and start < e for s, e in intervals)
+
+
+def bulk_schedule(calendar, items):
+    """
+    Schedule many emails with one set of services. Yields one result dict per
+    item, as soon as it is known:
+
+    - emails are parsed on a bounded thread pool;
+    - conflicts are checked against a single freebusy window spanning every
+      parsed event, plus the events accepted earlier in this import;
+    - accepted events are inserted with Calendar batch requests.
+
+    Busy slots are reported as conflicts; no alternate-slot emails are sent.
+    """
+    parsed = []
+    with ThreadPoolExecutor(max_workers=BULK_PARSE_CONCURRENCY) as pool:
+        futures = {}
+        for index, item in enumerate(items):
+            if not isinstance(item, dict) or not item.get("email_text") or not item.get("sender_email"):
+                yield {"index": index, "status": "error", "error": "Missing email_text or sender_email"}
+                continue
+            futures[pool.submit(_parse_item, item)] = (index, item)
+        for future in as_completed(futures):
+            index, item = futures[future]
+            try:
+                event = future.result()
+            except Exception as e:
+                yield {"index": index, "status": "error", "error": str(e)}
+                continue
+            if not event:
+                yield {"index": index, "status": "skipped", "error": "No meeting found"}
+                continue
+            start = to_local_datetime(event["date"], event["start"])
+            end = to_local_datetime(event["date"], event["end"])
+            if end <= start:
+                yield {"index": index, "status": "error", "error": "Event ends before it starts", "event": event}
+                continue
+            parsed.append((index, item, event, start, end))
+
+    if not parsed:
+        return
+
+    parsed.sort(key=lambda p: p[0])
+    busy = fetch_busy_index(calendar, min(p[3] for p in parsed), max(p[4] for p in parsed), timezone=TIMEZONE)
+    accepted = []
+    to_insert = []
+    for index, item, event, start, end in parsed:
+        if not busy.is_free(start, end) or _overlaps(start, end, accepted):
+            yield {"index": index, "status": "conflict", "event": event}
+            continue
+        accepted.append((start, end))
+        to_insert.append((index, item, event))
+
+    results = []
+    events = {index: event for index, _, event in to_insert}
+
+    def on_insert(request_id, response, exception):
+        index = int(request_id)
+        if exception is not None:
+            results.append({"index": index, "status": "error", "error": str(exception), "event": events[index]})
+        else:
+            results.append({"index": index, "status": "scheduled", "link": response.get("htmlLink"),
+                            "event": events[index]})
+
+    for i in range(0, len(to_insert), BATCH_SIZE):
+        batch = calendar.new_batch_http_request(callback=on_insert)
+        for index, item, event in to_insert[i:i + BATCH_SIZE]:
+            body = {
+                'summary': event['title'],
+                'start': {'dateTime': f"{event['date']}T{event['start']}:00", 'timeZone': TIMEZONE},
+                'end': {'dateTime': f"{event['date']}T{event['end']}:00", 'timeZone': TIMEZONE},
+                'attendees': [{'email': item['sender_email']}]
+            }
+            batch.add(
+                calendar.events().insert(calendarId='primary', body=body, sendUpdates="all"),
+                request_id=str(index)
+            )
+        batch.execute()
+        yield from results
+        results.clear()
+
+    if to_insert:
+        invalidate_freebusy(calendar)
@@ -1,29 +1,34 @@
 from googleapiclient.discovery import build
 import os
 import json
-from datetime import timedelta
+from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
-from openai import OpenAI
 from confirmation_tracker import add_pending_confirmation
+from llm_cache import llm_cache, make_key
+from llm_dispatcher import complete
+from slot_finder import find_free_slots, format_slot, search_window
+from freebusy_cache import get_busy_index, invalidate as invalidate_freebusy
 
 load_dotenv()
 TIMEZONE = os.getenv("TIMEZONE")
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+ALTERNATE_SLOTS_SOURCE = os.getenv("ALTERNATE_SLOTS_SOURCE", "local")  # local | gpt
+LLM_SUGGESTION_WORDING = os.getenv("LLM_SUGGESTION_WORDING", "0") == "1"
+
+def get_timezone_offset():
+    return timedelta(hours=5, minutes=30) if TIMEZONE == "Asia/Kolkata" else timedelta(0)
 
 def get_timezone_suffix():
-    offset = timedelta(hours=5, minutes=30) if TIMEZONE == "Asia/Kolkata" else timedelta(0)
+    offset = get_timezone_offset()
     return f"{offset.total_seconds() // 3600:+03.0f}:{int((offset.total_seconds() % 3600) / 60):02}"
 
+def to_local_datetime(date, time_str):
+    return datetime.fromisoformat(f"{date}T{time_str}:00").replace(tzinfo=timezone(get_timezone_offset()))
+
 def is_time_slot_free(service, start_time_iso, end_time_iso):
-    body = {
-        "timeMin": start_time_iso,
-        "timeMax": end_time_iso,
-        "timeZone": TIMEZONE,
-        "items": [{"id": "primary"}]
-    }
-    events_result = service.freebusy().query(body=body).execute()
-    busy_slots = events_result['calendars']['primary']['busy']
-    return len(busy_slots) == 0
+    start = datetime.fromisoformat(start_time_iso)
+    end = datetime.fromisoformat(end_time_iso)
+    index = get_busy_index(service, start, end, timezone=TIMEZONE)
+    return index.is_free(start, end)
 
 def generate_alternate_slots(event_info):
     prompt = f"""
@@ -51,18 +56,48 @@ Suggest two alternate time slots that are on the same day or nearby days, avoidi
   ]
 }}
 """
-    response = client.chat.completions.create(
-        model="gpt-4",
-        messages=[{"role": "user", "content": prompt}]
-    )
-    content = response.choices[0].message.content
+    key = make_key("alternate_slots", {k: event_info[k] for k in ("title", "date", "start", "end")})
+    content = llm_cache.get_or_call(key, lambda: complete(prompt))
     try:
         return json.loads(content)["options"]
     except Exception:
         print("⚠️ Could not parse alternate slots from GPT.")
         return []
 
-def schedule_event(service, event_info, sender_email=None, gmail_service=None):
+def find_alternate_slots(service, event_info, count=2):
+    """
+    Find the `count` nearest truly free slots of the requested duration from one
+    freebusy query over the surrounding days.
+    """
+    start = to_local_datetime(event_info['date'], event_info['start'])
+    end = to_local_datetime(event_info['date'], event_info['end'])
+    duration = end - start if end > start else timedelta(hours=1)
+    index = get_busy_index(service, *search_window(start), timezone=TIMEZONE)
+    return [format_slot(s, e) for s, e in find_free_slots(index, start, duration, count)]
+
+def compose_alternates_body(options):
+    body = "Hi, I'm unavailable at the requested time. Here are two alternate options:\n\n"
+    for idx, opt in enumerate(options, 1):
+        body += f"{idx}. {opt['date']} from {opt['start']} to {opt['end']}\n"
+    body += "\nPlease reply with your preferred option."
+    if not LLM_SUGGESTION_WORDING:
+        return body
+
+    prompt = f"""
+Rewrite this email so it sounds friendly and natural. Keep every numbered option, date and time exactly as written.
+Return only the email text.
+
+\"\"\"
+{body}
+\"\"\"
+"""
+    try:
+        return llm_cache.get_or_call(make_key("alternates_wording", options), lambda: complete(prompt))
+    except Exception as e:
+        print(f"⚠️ Could not reword suggestions: {e}")
+        return body
+
+def schedule_event(service, event_info, sender_email=None, gmail_service=None, uid=None):
     date = event_info['date']
     start = event_info['start']
     end = event_info['end']
@@ -73,14 +108,14 @@ def schedule_event(service, event_info, sender_email=None, gmail_service=None):
     if not is_time_slot_free(service, start_time_iso, end_time_iso):
         print("⛔ Time slot is busy — suggesting alternatives.")
         if sender_email and gmail_service:
-            options = generate_alternate_slots(event_info)
+            if ALTERNATE_SLOTS_SOURCE == "gpt":
+                options = generate_alternate_slots(event_info)
+            else:
+                options = find_alternate_slots(service, event_info)
             if options:
-                add_pending_confirmation(sender_email, options)
+                add_pending_confirmation(uid, sender_email, options)
 
-                body = "Hi, I'm unavailable at the requested time. Here are two alternate options:\n\n"
-                for idx, opt in enumerate(options, 1):
-                    body += f"{idx}. {opt['date']} from {opt['start']} to {opt['end']}\n"
-                body += "\nPlease reply with your preferred option."
+                body = compose_alternates_body(options)
 
                 send_email_reply(gmail_service, sender_email, "Alternate meeting time suggestions", body)
         return None
@@ -99,6 +134,7 @@ def schedule_event(service, event_info, sender_email=None, gmail_service=None):
         body=event,
         sendUpdates="all" if sender_email else "none"
     ).execute()
+    invalidate_freebusy(service)
 
     return created.get('htmlLink')
 
@@ -1,32 +1,222 @@
 import json
 import os
+import sqlite3
+import threading
+import time
+from datetime import date
+from firebase_utils import get_firestore
 
 PENDING_FILE = "pending_confirmations.json"
+PENDING_STORE = os.getenv("PENDING_STORE", "sqlite")  # sqlite | firestore
+PENDING_DB_PATH = os.getenv("PENDING_DB_PATH", "pending_confirmations.sqlite3")
+PENDING_TTL = float(os.getenv("PENDING_TTL", str(7 * 24 * 3600)))
+# The old global JSON file has no owner; its entries are imported for this user only, or dropped when unset
+PENDING_LEGACY_OWNER_UID = os.getenv("PENDING_LEGACY_OWNER_UID")
+# Owner placeholder used by an earlier import; such rows are handed to PENDING_LEGACY_OWNER_UID once it is set
+LEGACY_UID = "_legacy"
 
-def load_pending_confirmations():
-    if not os.path.exists(PENDING_FILE):
+
+def load_pending_confirmations(path=PENDING_FILE):
+    """
+    Read the legacy global JSON file. Only used as a migration source.
+    """
+    if not os.path.exists(path):
         return {}
-    with open(PENDING_FILE, "r") as f:
+    with open(path, "r") as f:
         return json.load(f)
 
-def save_pending_confirmations(data):
-    with open(PENDING_FILE, "w") as f:
-        json.dump(data, f, indent=2)
-
-def add_pending_confirmation(sender_email, options, message_id=None):
-    data = load_pending_confirmations()
-    data[sender_email] = {
-        "options": options,
-        "message_id": message_id
-    }
-    save_pending_confirmations(data)
-
-def remove_pending_confirmation(sender_email):
-    data = load_pending_confirmations()
-    if sender_email in data:
-        del data[sender_email]
-        save_pending_confirmations(data)
-
-def get_pending_confirmation(sender_email):
-    data = load_pending_confirmations()
-    return data.get(sender_email)
\ No newline at end of file
+
+class SQLiteConfirmationStore:
+    """
+    Pending proposals keyed by (uid, sender_email) in a WAL-mode SQLite table.
+    Each thread gets its own connection; every write is a single statement.
+    """
+
+    def __init__(self, path=PENDING_DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS pending_confirmations ("
+            "uid TEXT NOT NULL, sender_email TEXT NOT NULL, options TEXT NOT NULL, message_id TEXT, "
+            "created_at REAL NOT NULL, expires_at REAL NOT NULL, PRIMARY KEY (uid, sender_email))"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS pending_confirmations_expires_at ON pending_confirmations (expires_at)"
+        )
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, uid, sender_email):
+        row = self._conn().execute(
+            "SELECT options, message_id FROM pending_confirmations "
+            "WHERE uid = ? AND sender_email = ? AND expires_at > ?",
+            (uid, sender_email, time.time())
+        ).fetchone()
+        if row is None:
+            return None
+        return {"options": json.loads(row[0]), "message_id": row[1]}
+
+    def put(self, uid, sender_email, options, message_id=None, ttl=PENDING_TTL, replace=True):
+        now = time.time()
+        verb = "INSERT OR REPLACE" if replace else "INSERT OR IGNORE"
+        conn = self._conn()
+        conn.execute(
+            f"{verb} INTO pending_confirmations "
+            "(uid, sender_email, options, message_id, created_at, expires_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (uid, sender_email, json.dumps(options), message_id, now, now + ttl)
+        )
+        conn.commit()
+
+    def delete(self, uid, sender_email):
+        conn = self._conn()
+        conn.execute(
+            "DELETE FROM pending_confirmations WHERE uid = ? AND sender_email = ?", (uid, sender_email)
+        )
+        conn.commit()
+
+    def purge_expired(self):
+        conn = self._conn()
+        conn.execute("DELETE FROM pending_confirmations WHERE expires_at <= ?", (time.time(),))
+        conn.commit()
+
+    def adopt_legacy(self, owner_uid):
+        """
+        Hand ownerless rows from an earlier import to `owner_uid`. Without an
+        owner they are left alone (lookups ignore them) until they expire.
+        """
+        if not owner_uid:
+            return
+        conn = self._conn()
+        conn.execute(
+            "UPDATE OR IGNORE pending_confirmations SET uid = ? WHERE uid = ?", (owner_uid, LEGACY_UID)
+        )
+        # Rows the owner already has a newer proposal for
+        conn.execute("DELETE FROM pending_confirmations WHERE uid = ?", (LEGACY_UID,))
+        conn.commit()
+
+    def is_migrated(self):
+        row = self._conn().execute("SELECT value FROM meta WHERE key = 'json_migrated'").fetchone()
+        return row is not None
+
+    def mark_migrated(self):
+        conn = self._conn()
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('json_migrated', ?)", (str(time.time()),))
+        conn.commit()
+
+
+class FirestoreConfirmationStore:
+    """
+    Pending proposals in a users/{uid}/pending_confirmations subcollection,
+    one document per sender.
+    """
+
+    def _doc(self, uid, sender_email):
+        return get_firestore().collection("users").document(uid) \
+            .collection("pending_confirmations").document(sender_email)
+
+    def get(self, uid, sender_email):
+        doc = self._doc(uid, sender_email).get()
+        if not doc.exists:
+            return None
+        data = doc.to_dict()
+        if data.get("expires_at", 0) <= time.time():
+            return None
+        return {"options": data["options"], "message_id": data.get("message_id")}
+
+    def put(self, uid, sender_email, options, message_id=None, ttl=PENDING_TTL, replace=True):
+        now = time.time()
+        data = {"options": options, "message_id": message_id, "created_at": now, "expires_at": now + ttl}
+        doc_ref = self._doc(uid, sender_email)
+        if replace:
+            doc_ref.set(data)
+        elif not doc_ref.get().exists:
+            doc_ref.set(data)
+
+    def delete(self, uid, sender_email):
+        self._doc(uid, sender_email).delete()
+
+    def purge_expired(self):
+        # Expired documents are ignored on read; use a Firestore TTL policy on expires_at to delete them
+        pass
+
+    def adopt_legacy(self, owner_uid):
+        # Nothing was ever imported under LEGACY_UID into Firestore
+        pass
+
+    def _meta(self):
+        return get_firestore().collection("meta").document("pending_confirmations")
+
+    def is_migrated(self):
+        doc = self._meta().get()
+        return doc.exists and bool((doc.to_dict() or {}).get("json_migrated"))
+
+    def mark_migrated(self):
+        self._meta().set({"json_migrated": time.time()}, merge=True)
+
+
+def _is_expired(entry, today=None):
+    """
+    The JSON file has no timestamps; an entry is stale once every offered slot is in the past.
+    """
+    today = (today or date.today()).isoformat()
+    return not any(str(option.get("date", "")) >= today for option in entry.get("options", []))
+
+
+def migrate_json_file(store, path=PENDING_FILE, uid=None):
+    """
+    Import live entries from the legacy JSON file for `uid` without overwriting
+    newer ones. Without an owner nothing is imported (entries are never shared)
+    and the file is left for a later start. Returns True once the file is handled.
+    """
+    data = load_pending_confirmations(path)
+    if not data:
+        return True
+    if not uid:
+        print(f"⚠️ Not importing {len(data)} pending confirmations from {path}: set PENDING_LEGACY_OWNER_UID to import them")
+        return False
+    live = {sender: entry for sender, entry in data.items() if not _is_expired(entry)}
+    for sender_email, entry in live.items():
+        store.put(uid, sender_email, entry.get("options", []), entry.get("message_id"), replace=False)
+    print(f"📦 Migrated {len(live)} of {len(data)} pending confirmations from {path} for {uid}")
+    return True
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                store = FirestoreConfirmationStore() if PENDING_STORE == "firestore" else SQLiteConfirmationStore()
+                store.adopt_legacy(PENDING_LEGACY_OWNER_UID)
+                if not store.is_migrated() and migrate_json_file(store, uid=PENDING_LEGACY_OWNER_UID):
+                    store.mark_migrated()
+                _store = store
+    return _store
+
+
+def add_pending_confirmation(uid, sender_email, options, message_id=None):
+    store = get_store()
+    store.put(uid, sender_email, options, message_id)
+    store.purge_expired()
+
+
+def remove_pending_confirmation(uid, sender_email):
+    store = get_store()
+    store.delete(uid, sender_email)
+
+
+def get_pending_confirmation(uid, sender_email):
+    return get_store().get(uid, sender_email)
@@ -1,27 +1,289 @@
-
-from googleapiclient.discovery import build
+from html.parser import HTMLParser
 import base64
+import codecs
+import os
+import re
+
+MAX_BODY_CHARS = int(os.getenv("MAX_BODY_CHARS", "3000"))
+DECODE_CHUNK = 8192  # base64 characters per decode step; a multiple of 4
+
+SKIP_MIME_PREFIXES = ("image/", "audio/", "video/", "application/", "font/")
+QUOTE_MARKERS = [
+    re.compile(r"^On .{0,200}wrote:\s*$"),
+    re.compile(r"^-{2,}\s*Original Message\s*-{2,}", re.IGNORECASE),
+    re.compile(r"^_{10,}\s*$"),
+]
+# Forwarded mail is kept: only the marker and the header lines right after it are dropped
+FORWARD_MARKER = re.compile(r"-{2,}\s*Forwarded message\s*-{2,}|^Begin forwarded message:", re.IGNORECASE)
+HEADER_LINE = re.compile(r"^(From|Sent|Date|To|Cc|Subject):\s", re.IGNORECASE)
+OUTLOOK_HEADER_FIELD = re.compile(r"^(Sent|Date|To|Cc|Subject):\s", re.IGNORECASE)
+SIGNATURE_MARKERS = [
+    re.compile(r"^--\s*$"),
+    re.compile(r"^Sent from my \w+", re.IGNORECASE),
+    re.compile(r"^Get Outlook for \w+", re.IGNORECASE),
+]
+
+
+def _iter_decoded(data):
+    """
+    Incrementally base64url-decode `data`, yielding text chunks so callers can
+    stop once they have enough characters.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    for i in range(0, len(data), DECODE_CHUNK):
+        chunk = data[i:i + DECODE_CHUNK]
+        chunk += "=" * (-len(chunk) % 4)
+        yield decoder.decode(base64.urlsafe_b64decode(chunk))
+    yield decoder.decode(b"", final=True)
+
+
+def _decode_prefix(data, budget):
+    text = ""
+    for chunk in _iter_decoded(data):
+        text += chunk
+        if len(text) >= budget:
+            break
+    return text
+
+
+class _HTMLTextExtractor(HTMLParser):
+    """
+    Collects visible text, skipping script/style and quoted history
+    (<blockquote>, Gmail's div.gmail_quote). A skipped quote that turns out
+    to be a forwarded message is kept.
+    """
+    BLOCK_TAGS = {"p", "div", "br", "tr", "li", "h1", "h2", "h3", "h4", "h5", "h6"}
+    SKIP_TAGS = {"script", "style", "head", "title", "blockquote"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.length = 0
+        # Open elements with the same tag as the one that started the skipped region, including it;
+        # other tags are not counted since <p>, <li>, <td>... are often closed implicitly
+        self._skip_depth = 0
+        self._skip_tag = None
+        self._skipped = []
+
+    def handle_starttag(self, tag, attrs):
+        if self._skip_depth:
+            if tag == self._skip_tag:
+                self._skip_depth += 1
+            if tag in self.BLOCK_TAGS:
+                self._skipped.append("\n")
+            return
+        classes = dict(attrs).get("class") or ""
+        if tag in self.SKIP_TAGS or "gmail_quote" in classes:
+            self._skip_depth = 1
+            self._skip_tag = tag
+            self._skipped = []
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if not self._skip_depth or tag != self._skip_tag:
+            return
+        self._skip_depth -= 1
+        if self._skip_depth == 0:
+            skipped = "".join(self._skipped)
+            if self._skip_tag in ("div", "blockquote") and FORWARD_MARKER.search(skipped):
+                self.parts.append("\n" + skipped)
+                self.length += len(skipped)
+            self._skipped = []
+
+    def handle_data(self, data):
+        if self._skip_depth:
+            self._skipped.append(data)
+        else:
+            self.parts.append(data)
+            self.length += len(data)
+
+    def text(self):
+        return "".join(self.parts)
+
+
+def html_to_text(data, budget):
+    """
+    Decode and strip an HTML part, stopping once `budget` characters of text are collected.
+    """
+    parser = _HTMLTextExtractor()
+    for chunk in _iter_decoded(data):
+        parser.feed(chunk)
+        if parser.length >= budget:
+            break
+    text = parser.text()
+    text = re.sub(r"[ \t\r\f\v]+", " ", text)
+    return re.sub(r"\n\s*\n+", "\n\n", text).strip()
+
+
+def _is_outlook_header(lines, i):
+    """
+    True if lines[i] starts an Outlook-style quoted header block (From: followed by Sent/To/Subject lines).
+    """
+    following = [line.strip() for line in lines[i + 1:i + 5]]
+    return sum(1 for line in following if OUTLOOK_HEADER_FIELD.match(line)) >= 2
+
+
+def strip_quotes_and_signature(text):
+    """
+    Keep only the new part of a reply: drop '>' quoted lines and cut at the
+    first quoted-history header or signature delimiter. Forwarded messages
+    are kept, minus their header lines.
+    """
+    kept = []
+    lines = text.splitlines()
+    in_signature = False
+    i = 0
+    while i < len(lines):
+        stripped = lines[i].strip()
+        if FORWARD_MARKER.search(stripped):
+            in_signature = False
+            i += 1
+            while i < len(lines) and (not lines[i].strip() or HEADER_LINE.match(lines[i].strip())):
+                i += 1
+            continue
+        # "On <date>, <name> wrote:" is often wrapped onto two lines
+        joined = f"{stripped} {lines[i + 1].strip()}" if i + 1 < len(lines) else stripped
+        if any(m.match(stripped) for m in QUOTE_MARKERS) or \
+                (stripped.startswith("On ") and QUOTE_MARKERS[0].match(joined)) or \
+                (stripped.lower().startswith("from:") and _is_outlook_header(lines, i)):
+            break
+        if any(m.match(stripped) for m in SIGNATURE_MARKERS):
+            # Drop the signature but keep looking for forwarded content below it
+            in_signature = True
+        elif not in_signature and not stripped.startswith(">"):
+            kept.append(lines[i])
+        i += 1
+    return "\n".join(kept).strip()
+
+
+def _is_attachment(part):
+    if part.get("filename"):
+        return True
+    body = part.get("body", {})
+    if "attachmentId" in body:
+        return True
+    return part.get("mimeType", "").startswith(SKIP_MIME_PREFIXES)
+
+
+def _find_part(payload, mime_type):
+    """
+    Depth-first search for the first inline part of `mime_type` that carries data.
+    """
+    stack = [payload]
+    while stack:
+        part = stack.pop()
+        if "parts" in part:
+            # Reverse so parts are visited in document order
+            stack.extend(reversed(part["parts"]))
+            continue
+        if _is_attachment(part):
+            continue
+        if part.get("mimeType", "text/plain") == mime_type and part.get("body", {}).get("data"):
+            return part
+    return None
+
+
+def extract_body(payload, max_chars=MAX_BODY_CHARS):
+    """
+    Return up to `max_chars` of the message's new text: prefers text/plain,
+    falls back to stripped text/html, skips attachments and inline images,
+    and drops quoted reply history and signatures.
+    """
+    part = _find_part(payload, "text/plain")
+    try:
+        if part is not None:
+            text = _decode_prefix(part["body"]["data"], max_chars)
+        else:
+            part = _find_part(payload, "text/html")
+            if part is None:
+                return "No message body found"
+            text = html_to_text(part["body"]["data"], max_chars)
+    except (ValueError, TypeError) as e:
+        print(f"⚠️ Could not decode message body: {e}")
+        return "No message body found"
+    return strip_quotes_and_signature(text)[:max_chars] or "No message body found"
+
+def extract_sender_email(headers):
+    sender = next((h['value'] for h in headers if h['name'].lower() == 'from'), None)
+    if sender:
+        match = re.search(r'<(.+?)>', sender)
+        return match.group(1) if match else sender
+    return None
+
+BATCH_SIZE = 50  # Gmail recommends at most 50 requests per batch
+BATCH_MODIFY_LIMIT = 1000
+
+def _to_message(msg_id, msg):
+    payload = msg.get("payload", {})
+    return {
+        "id": msg_id,
+        "sender_email": extract_sender_email(payload.get("headers", [])),
+        "body": extract_body(payload),
+        "payload": payload,
+    }
+
+METADATA_HEADERS = ["From", "Subject", "In-Reply-To", "List-Unsubscribe", "Precedence", "Auto-Submitted"]
+
+def _batch_get(service, msg_ids, **params):
+    """
+    messages.get many IDs with HTTP batch requests, returning {id: response}.
+    Messages that fail inside a batch are retried individually; ones that still fail are skipped.
+    """
+    fetched = {}
+    failed = []
 
+    def on_response(request_id, response, exception):
+        if exception is not None:
+            failed.append(request_id)
+        else:
+            fetched[request_id] = response
 
+    for i in range(0, len(msg_ids), BATCH_SIZE):
+        batch = service.new_batch_http_request(callback=on_response)
+        for msg_id in msg_ids[i:i + BATCH_SIZE]:
+            batch.add(service.users().messages().get(userId='me', id=msg_id, **params), request_id=msg_id)
+        batch.execute()
 
+    for msg_id in failed:
+        try:
+            fetched[msg_id] = service.users().messages().get(userId='me', id=msg_id, **params).execute()
+        except Exception as e:
+            print(f"⚠️ Failed to fetch message {msg_id}: {e}")
 
-def extract_body(payload):
-    if 'data' in payload.get('body', {}):
-        return base64.urlsafe_b64decode(payload['body']['data']).decode('utf-8')
-    elif 'parts' in payload:
-        for part in payload['parts']:
-            try:
-                return extract_body(part)
-            except:
-                continue
-    return "No message body found"
+    return fetched
 
-def get_latest_unread_email(service):
-    results = service.users().messages().list(userId='me', labelIds=['INBOX'], q="is:unread", maxResults=1).execute()
-    messages = results.get('messages', [])
-    if not messages:
-        return None
+def fetch_messages(service, msg_ids):
+    """
+    Fetch many full messages with HTTP batch requests, preserving the order of `msg_ids`.
+    """
+    fetched = _batch_get(service, msg_ids, format='full')
+    return [_to_message(msg_id, fetched[msg_id]) for msg_id in msg_ids if msg_id in fetched]
 
-    msg = service.users().messages().get(userId='me', id=messages[0]['id'], format='full').execute()
-    return extract_body(msg['payload'])
+def fetch_metadata(service, msg_ids, headers=METADATA_HEADERS):
+    """
+    Fetch only the routing headers of many messages (format='metadata'), preserving order.
+    Returns dicts with id, sender_email and a lower-cased {header: value} map.
+    """
+    fetched = _batch_get(service, msg_ids, format='metadata', metadataHeaders=headers)
+    results = []
+    for msg_id in msg_ids:
+        if msg_id not in fetched:
+            continue
+        raw_headers = fetched[msg_id].get("payload", {}).get("headers", [])
+        results.append({
+            "id": msg_id,
+            "sender_email": extract_sender_email(raw_headers),
+            "headers": {h["name"].lower(): h["value"] for h in raw_headers}
+        })
+    return results
 
+def mark_all_as_read(service, msg_ids):
+    """
+    Remove the UNREAD label from many messages with messages.batchModify.
+    """
+    for i in range(0, len(msg_ids), BATCH_MODIFY_LIMIT):
+        service.users().messages().batchModify(
+            userId='me',
+            body={'ids': msg_ids[i:i + BATCH_MODIFY_LIMIT], 'removeLabelIds': ['UNREAD']}
+        ).execute()
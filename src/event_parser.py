@@ -1,14 +1,67 @@
-from openai import OpenAI
 from dotenv import load_dotenv
 import os
+import json
+import threading
+from collections import Counter
 from datetime import datetime
+from rule_extractor import classify_email
+from llm_cache import llm_cache, make_key
+from llm_dispatcher import complete
+from structured_output import EVENT_SCHEMA, EVENT_BATCH_SCHEMA, response_format, parse_event_batch_output
 load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+LOCAL_EXTRACTOR = os.getenv("LOCAL_EXTRACTOR", "1") == "1"
+# Batched extraction: prompt-token budget and item cap for one multi-email request
+LLM_BATCH_TOKEN_BUDGET = int(os.getenv("LLM_BATCH_TOKEN_BUDGET", "6000"))
+LLM_BATCH_MAX_ITEMS = int(os.getenv("LLM_BATCH_MAX_ITEMS", "10"))
+
+_parse_stats = Counter()
+_batch_stats = Counter()
+_stats_lock = threading.Lock()
+
+def _record_path(path):
+    with _stats_lock:
+        _parse_stats[path] += 1
+
+def get_parse_stats():
+    """
+    Counts and hit rates for each parse path: "rule", "skip" and "llm",
+    plus batched-extraction counters.
+    """
+    with _stats_lock:
+        counts = dict(_parse_stats)
+        batch = dict(_batch_stats)
+    total = sum(counts.values())
+    return {
+        "total": total,
+        "counts": counts,
+        "rates": {path: n / total for path, n in counts.items()} if total else {},
+        "batch": batch
+    }
 
 MAX_EMAIL_LENGTH = 3000  # You can tune this lower if you still hit limits
 today = datetime.utcnow().strftime("%Y-%m-%d")
+def _local_parse(truncated_email):
+    """
+    Try the rule extractor; returns the JSON string it settles on, or None to fall through to the LLM.
+    """
+    if not LOCAL_EXTRACTOR:
+        return None
+    path, event = classify_email(truncated_email)
+    if path == "rule":
+        _record_path("rule")
+        return json.dumps(event)
+    if path == "skip":
+        _record_path("skip")
+        return "{}"
+    return None
+
 def parse_event(email_text):
     truncated_email = email_text.strip()[:MAX_EMAIL_LENGTH]
+    local = _local_parse(truncated_email)
+    if local is not None:
+        return local
+    _record_path("llm")
+
     today = datetime.utcnow().strftime("%Y-%m-%d")
     prompt = f""" Today's date is {today}.
     You are a meeting assistant that extracts calendar events from email messages.
@@ -34,11 +87,106 @@ Email:
 \"\"\"
 """
 
-    response = client.chat.completions.create(
-        model="gpt-4",
-        messages=[{"role": "user", "content": prompt}]
-    )
-    return response.choices[0].message.content
+    return llm_cache.get_or_call(make_key("parse_event", truncated_email, today),
+                                 lambda: complete(prompt, **response_format("event", EVENT_SCHEMA)))
+
+def _batch_prompt(items, today):
+    emails = "\n\n".join(f'<email id="{msg_id}">\n{text}\n</email>' for msg_id, text in items)
+    return f""" Today's date is {today}.
+    You are a meeting assistant that extracts calendar events from several email messages at once.
+    Ensure that suggested times are in the future only.
+Return a strict JSON array with exactly one element per email, in this format:
+[
+  {{"id": "<email id>", "event": {{"title": "Team Sync", "date": "YYYY-MM-DD", "start": "HH:MM", "end": "HH:MM"}}}}
+]
+
+Rules:
+- Convert relative dates like "tomorrow", "next Friday", or "day after" into YYYY-MM-DD format using today as {today}.
+- Interpret common casual intent phrases like "let’s sync", "catch up", "quick call", "connect", "discussion", etc., and assign them a meaningful title.
+- Time must be in 24-hour HH:MM format.
+- If an email contains no meeting, use an empty object for its event: {{}}
+- DO NOT include any explanations, only valid JSON.
+
+Emails:
+{emails}
+"""
+
+def _pack_batches(items, budget=LLM_BATCH_TOKEN_BUDGET, max_items=LLM_BATCH_MAX_ITEMS):
+    """
+    Group (msg_id, text) pairs so each group's bodies stay within the token budget (~4 chars/token).
+    """
+    batch, used = [], 0
+    for msg_id, text in items:
+        tokens = len(text) // 4 + 1
+        if batch and (used + tokens > budget or len(batch) >= max_items):
+            yield batch
+            batch, used = [], 0
+        batch.append((msg_id, text))
+        used += tokens
+    if batch:
+        yield batch
+
+def _parse_one(msg_id, text):
+    try:
+        return parse_event(text)
+    except Exception as e:
+        print(f"⚠️ Extraction failed for message {msg_id}: {e}")
+        with _stats_lock:
+            _batch_stats["failed"] += 1
+        return ""
+
+def parse_events(emails):
+    """
+    Batched parse_event for one poll cycle. `emails` is a list of (msg_id, email_text);
+    returns {msg_id: JSON string} in the same shape parse_event returns, or ""
+    for an item whose LLM call failed, so one bad email can't abort the cycle.
+
+    Rule/cached results are resolved locally. The rest are packed into as few
+    LLM requests as the token budget allows, each returning a JSON array keyed
+    by message ID; items missing or failing schema validation are retried one by one.
+    """
+    today = datetime.utcnow().strftime("%Y-%m-%d")
+    results = {}
+    pending = []
+    for msg_id, email_text in emails:
+        truncated_email = email_text.strip()[:MAX_EMAIL_LENGTH]
+        local = _local_parse(truncated_email)
+        if local is not None:
+            results[msg_id] = local
+            continue
+        cached = llm_cache.get(make_key("parse_event", truncated_email, today))
+        if cached is not None:
+            _record_path("llm")
+            results[msg_id] = cached
+            continue
+        pending.append((msg_id, truncated_email))
+
+    if len(pending) == 1:
+        msg_id, text = pending[0]
+        results[msg_id] = _parse_one(msg_id, text)
+        return results
+
+    texts = dict(pending)
+    for batch in _pack_batches(pending):
+        expected = {msg_id for msg_id, _ in batch}
+        try:
+            reply = complete(_batch_prompt(batch, today), **response_format("event_batch", EVENT_BATCH_SCHEMA))
+            valid = parse_event_batch_output(reply, expected)
+        except Exception as e:
+            print(f"⚠️ Batched extraction failed: {e}")
+            valid = {}
+        with _stats_lock:
+            _batch_stats["requests"] += 1
+            _batch_stats["items"] += len(batch)
+            _batch_stats["retried"] += len(expected) - len(valid)
+        for msg_id, event in valid.items():
+            _record_path("llm")
+            parsed = json.dumps(event)
+            llm_cache.set(make_key("parse_event", texts[msg_id], today), parsed)
+            results[msg_id] = parsed
+        for msg_id in expected - set(valid):
+            results[msg_id] = _parse_one(msg_id, texts[msg_id])
+    return results
 
 def get_today():
     from datetime import datetime
@@ -0,0 +1,57 @@
+import os
+import threading
+import time
+import weakref
+from datetime import timedelta
+from slot_finder import fetch_busy_index
+
+FREEBUSY_CACHE_TTL = float(os.getenv("FREEBUSY_CACHE_TTL", "120"))
+FREEBUSY_WINDOW_DAYS = int(os.getenv("FREEBUSY_WINDOW_DAYS", "7"))
+
+# Calendar services are cached per UID (see service_cache), so keying on the
+# service object gives a per-user cache that goes away with the service.
+_windows = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+
+def _window_for(start, end):
+    day = start.replace(hour=0, minute=0, second=0, microsecond=0)
+    time_min = day - timedelta(days=1)
+    time_max = max(day + timedelta(days=FREEBUSY_WINDOW_DAYS), end)
+    return time_min, time_max
+
+
+def get_busy_index(service, start, end, timezone=None):
+    """
+    Return a BusyIndex covering [start, end), reusing a cached window for this
+    calendar when one is fresh, otherwise fetching a week-sized window once.
+    """
+    now = time.monotonic()
+    with _lock:
+        for fetched_at, index in _windows.get(service, []):
+            if now - fetched_at < FREEBUSY_CACHE_TTL and index.covers(start, end):
+                _stats["hits"] += 1
+                return index
+        _stats["misses"] += 1
+
+    index = fetch_busy_index(service, *_window_for(start, end), timezone=timezone)
+    with _lock:
+        fresh = [(t, i) for t, i in _windows.get(service, []) if now - t < FREEBUSY_CACHE_TTL]
+        fresh.append((now, index))
+        _windows[service] = fresh
+    return index
+
+
+def invalidate(service):
+    """
+    Drop cached windows for a calendar, e.g. after an event is inserted.
+    """
+    with _lock:
+        if _windows.pop(service, None) is not None:
+            _stats["invalidations"] += 1
+
+
+def get_freebusy_stats():
+    with _lock:
+        return dict(_stats)
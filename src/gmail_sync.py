@@ -0,0 +1,124 @@
+import os
+from googleapiclient.errors import HttpError
+from firebase_utils import get_firestore
+from user_repository import user_repository
+
+INCREMENTAL_SYNC = os.getenv("GMAIL_INCREMENTAL_SYNC", "1") == "1"
+FULL_RESYNC_LIMIT = int(os.getenv("GMAIL_FULL_RESYNC_LIMIT", "50"))
+HISTORY_PAGE_LIMIT = int(os.getenv("GMAIL_HISTORY_PAGE_LIMIT", "10"))
+LEGACY_MAX_RESULTS = 5
+
+
+def load_history_id(uid):
+    """
+    Load the last synced Gmail historyId for a user from Firestore.
+    """
+    try:
+        user = user_repository.get(uid, ["gmail_history_id"])
+        if user is not None:
+            return user.get("gmail_history_id")
+    except Exception as e:
+        print(f"⚠️ Failed to load history ID for UID {uid}: {e}")
+    return None
+
+
+def save_history_id(uid, history_id):
+    db = get_firestore()
+    try:
+        db.collection("users").document(uid).set({"gmail_history_id": str(history_id)}, merge=True)
+        user_repository.note_write(uid, {"gmail_history_id": str(history_id)})
+    except Exception as e:
+        print(f"⚠️ Failed to save history ID for UID {uid}: {e}")
+
+
+def list_unread_message_ids(gmail, max_results=LEGACY_MAX_RESULTS):
+    """
+    List up to `max_results` unread inbox message IDs, newest first.
+    """
+    ids = []
+    page_token = None
+    while len(ids) < max_results:
+        results = gmail.users().messages().list(
+            userId='me', labelIds=['INBOX'], q="is:unread",
+            maxResults=min(max_results - len(ids), 500), pageToken=page_token
+        ).execute()
+        ids.extend(m['id'] for m in results.get('messages', []))
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            break
+    return ids[:max_results]
+
+
+def full_resync(gmail, uid):
+    """
+    Bounded resync used on first run or when the stored historyId has expired.
+    The profile historyId is read first so nothing added during the scan is missed.
+    Returns (message_ids, history_id).
+    """
+    history_id = gmail.users().getProfile(userId='me').execute().get('historyId')
+    ids = list_unread_message_ids(gmail, FULL_RESYNC_LIMIT)
+    print(f"🔄 Full Gmail resync for {uid}: {len(ids)} unread messages")
+    return ids, history_id
+
+
+def fetch_history_message_ids(gmail, start_history_id):
+    """
+    Return (message_ids, latest_history_id) for unread inbox messages added
+    since `start_history_id`. Raises HttpError 404 if the ID has expired.
+    """
+    ids = []
+    seen = set()
+    latest = start_history_id
+    last_record_id = start_history_id
+    page_token = None
+    for _ in range(HISTORY_PAGE_LIMIT):
+        results = gmail.users().history().list(
+            userId='me', startHistoryId=start_history_id, labelId='INBOX',
+            historyTypes=['messageAdded'], pageToken=page_token
+        ).execute()
+        for record in results.get('history', []):
+            last_record_id = record.get('id', last_record_id)
+            for added in record.get('messagesAdded', []):
+                message = added.get('message', {})
+                labels = message.get('labelIds', [])
+                if 'UNREAD' not in labels or message['id'] in seen:
+                    continue
+                seen.add(message['id'])
+                ids.append(message['id'])
+        latest = results.get('historyId', latest)
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            break
+    if page_token:
+        # Page limit hit: resume from the last record read next cycle
+        latest = last_record_id
+    return ids, latest
+
+
+def sync_new_message_ids(gmail, uid):
+    """
+    Return (message_ids, history_id) for unread inbox messages that arrived
+    since the last cycle. `history_id` is the cursor to store with
+    save_history_id once those messages have been handled, or None if it
+    did not move; the cursor is never advanced here.
+
+    Uses users.history.list from the stored historyId; falls back to a
+    bounded full resync when there is no stored ID or it has expired.
+    With incremental sync disabled, lists the latest unread messages instead.
+    """
+    if not INCREMENTAL_SYNC:
+        return list_unread_message_ids(gmail), None
+
+    start_history_id = load_history_id(uid)
+    if not start_history_id:
+        return full_resync(gmail, uid)
+
+    try:
+        ids, latest = fetch_history_message_ids(gmail, start_history_id)
+    except HttpError as e:
+        if e.resp.status == 404:
+            print(f"⚠️ History ID expired for {uid}, running full resync")
+            return full_resync(gmail, uid)
+        raise
+
+    return ids, latest if str(latest) != str(start_history_id) else None
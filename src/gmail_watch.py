@@ -0,0 +1,106 @@
+import base64
+import hmac
+import json
+import os
+import threading
+import time
+from firebase_utils import get_firestore
+from user_repository import user_repository
+
+GMAIL_PUSH_ENABLED = os.getenv("GMAIL_PUSH_ENABLED", "0") == "1"
+GMAIL_PUBSUB_TOPIC = os.getenv("GMAIL_PUBSUB_TOPIC")  # projects/<project>/topics/<topic>
+PUBSUB_VERIFICATION_TOKEN = os.getenv("PUBSUB_VERIFICATION_TOKEN")
+# Watches last 7 days; renew a day early
+WATCH_RENEW_MARGIN = float(os.getenv("GMAIL_WATCH_RENEW_MARGIN", str(24 * 3600)))
+
+_address_to_uid = {}
+_lock = threading.Lock()
+
+if GMAIL_PUSH_ENABLED and not PUBSUB_VERIFICATION_TOKEN:
+    print("⚠️ GMAIL_PUSH_ENABLED is set without PUBSUB_VERIFICATION_TOKEN; /gmail/push will reject every push")
+
+
+def verify_push_token(token):
+    """
+    True only when a verification token is configured and `token` matches it.
+    """
+    if not PUBSUB_VERIFICATION_TOKEN or not token:
+        return False
+    return hmac.compare_digest(token, PUBSUB_VERIFICATION_TOKEN)
+
+
+def watch_needs_renewal(expiration_ms):
+    if not expiration_ms:
+        return True
+    return int(expiration_ms) / 1000 - WATCH_RENEW_MARGIN <= time.time()
+
+
+def start_watch(gmail, uid):
+    """
+    Call users.watch for the user's INBOX and record the expiration and
+    Gmail address in Firestore. Returns the watch expiration (ms since epoch).
+    """
+    response = gmail.users().watch(userId='me', body={
+        "topicName": GMAIL_PUBSUB_TOPIC,
+        "labelIds": ["INBOX"],
+        "labelFilterBehavior": "include"
+    }).execute()
+    address = (gmail.users().getProfile(userId='me').execute().get("emailAddress") or "").lower()
+    expiration = response.get("expiration")
+
+    db = get_firestore()
+    updates = {"gmail_address": address or None, "gmail_watch_expiration": expiration}
+    db.collection("users").document(uid).set(updates, merge=True)
+    user_repository.note_write(uid, updates)
+    if address:
+        with _lock:
+            _address_to_uid[address] = uid
+    print(f"📡 Gmail watch active for {uid} until {expiration}")
+    return expiration
+
+
+def ensure_watch(gmail, uid, expiration_ms=None):
+    """
+    Start or renew the user's watch when push mode is on and the current one is
+    missing or about to expire. Returns the expiration in effect, or None.
+    """
+    if not GMAIL_PUSH_ENABLED or not GMAIL_PUBSUB_TOPIC:
+        return None
+    if not watch_needs_renewal(expiration_ms):
+        return expiration_ms
+    try:
+        return start_watch(gmail, uid)
+    except Exception as e:
+        print(f"⚠️ Failed to start Gmail watch for {uid}: {e}")
+        return None
+
+
+def uid_for_address(address):
+    """
+    Map a Gmail address from a push notification to a UID.
+    """
+    address = address.lower()
+    with _lock:
+        uid = _address_to_uid.get(address)
+    if uid:
+        return uid
+    db = get_firestore()
+    for doc in db.collection("users").where("gmail_address", "==", address).limit(1).stream():
+        with _lock:
+            _address_to_uid[address] = doc.id
+        return doc.id
+    return None
+
+
+def decode_push(envelope):
+    """
+    Decode a Pub/Sub push envelope into Gmail's {"emailAddress", "historyId"} payload.
+    """
+    message = (envelope or {}).get("message") or {}
+    data = message.get("data")
+    if not data:
+        raise ValueError("Push message has no data")
+    payload = json.loads(base64.b64decode(data).decode("utf-8"))
+    if "emailAddress" not in payload:
+        raise ValueError("Push payload has no emailAddress")
+    return payload
@@ -0,0 +1,192 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+ASYNC_JOBS = os.getenv("ASYNC_JOBS", "0") == "1"
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", "jobs.sqlite3")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+# A job still "running" this long after it was claimed is assumed lost (worker crash) and requeued
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "600"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "2"))
+JOB_RETENTION = float(os.getenv("JOB_RETENTION", str(24 * 3600)))
+# Idle workers also re-check the table this often, for jobs enqueued by other processes
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))
+
+FINISHED = ("done", "failed")
+
+
+class JobQueue:
+    """
+    SQLite-backed job queue drained by a pool of worker threads.
+
+    Handlers are registered per job kind and return (result, http_status);
+    an exception marks the job failed. Jobs claimed by a worker that dies are
+    requeued once their lease expires, so several app processes can share
+    one database file.
+    """
+
+    def __init__(self, path=JOB_DB_PATH, workers=JOB_WORKERS):
+        self.path = path
+        self.workers = workers
+        self._handlers = {}
+        self._local = threading.local()
+        # Workers wait on _queued; job watchers (SSE streams) wait on _finished
+        self._queued = threading.Condition()
+        self._finished = threading.Condition()
+        self._stop_event = threading.Event()
+        self._threads = []
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, uid TEXT NOT NULL, kind TEXT NOT NULL, payload TEXT NOT NULL, "
+            "status TEXT NOT NULL, result TEXT, http_status INTEGER, error TEXT, attempts INTEGER NOT NULL DEFAULT 0, "
+            "created_at REAL NOT NULL, updated_at REAL NOT NULL, lease_until REAL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_status_created_at ON jobs (status, created_at)")
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def register(self, kind, handler):
+        self._handlers[kind] = handler
+
+    def enqueue(self, uid, kind, payload):
+        """
+        Store a job and wake a worker. Returns the job ID.
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self._conn().execute(
+            "INSERT INTO jobs (id, uid, kind, payload, status, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, 'queued', ?, ?)",
+            (job_id, uid, kind, json.dumps(payload), now, now)
+        )
+        with self._queued:
+            self._queued.notify()
+        return job_id
+
+    def get(self, job_id, uid=None):
+        """
+        Return a job's status and result, or None if it does not exist (or belongs to another user).
+        """
+        row = self._conn().execute(
+            "SELECT id, uid, kind, status, result, http_status, error, attempts, created_at, updated_at "
+            "FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        if row is None or (uid is not None and row[1] != uid):
+            return None
+        return {
+            "id": row[0],
+            "kind": row[2],
+            "status": row[3],
+            "result": json.loads(row[4]) if row[4] else None,
+            "http_status": row[5],
+            "error": row[6],
+            "attempts": row[7],
+            "created_at": row[8],
+            "updated_at": row[9]
+        }
+
+    def wait(self, timeout):
+        """
+        Block until some job finishes in this process or `timeout` passes.
+        """
+        with self._finished:
+            self._finished.wait(timeout)
+
+    def _claim(self):
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT id, uid, kind, payload, attempts FROM jobs "
+                "WHERE status = 'queued' OR (status = 'running' AND lease_until < ?) "
+                "ORDER BY created_at LIMIT 1", (now,)
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', attempts = attempts + 1, updated_at = ?, lease_until = ? "
+                    "WHERE id = ?", (now, now + JOB_LEASE_SECONDS, row[0])
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return row
+
+    def _finish(self, job_id, status, result=None, http_status=None, error=None):
+        self._conn().execute(
+            "UPDATE jobs SET status = ?, result = ?, http_status = ?, error = ?, updated_at = ?, lease_until = NULL "
+            "WHERE id = ?",
+            (status, json.dumps(result) if result is not None else None, http_status, error, time.time(), job_id)
+        )
+        with self._finished:
+            self._finished.notify_all()
+
+    def _run_job(self, row):
+        job_id, uid, kind, payload, attempts = row
+        handler = self._handlers.get(kind)
+        if handler is None:
+            self._finish(job_id, "failed", error=f"Unknown job kind: {kind}")
+            return
+        if attempts >= JOB_MAX_ATTEMPTS:
+            # Claimed again after its lease expired too many times; don't retry a job that keeps killing workers
+            self._finish(job_id, "failed", error="Job abandoned after repeated worker failures")
+            return
+        try:
+            result, http_status = handler(uid, json.loads(payload))
+            self._finish(job_id, "done", result, http_status)
+        except Exception as e:
+            print(f"❌ Job {job_id} ({kind}) failed: {e}")
+            self._finish(job_id, "failed", error=str(e), http_status=500)
+
+    def _worker_loop(self):
+        while not self._stop_event.is_set():
+            try:
+                row = self._claim()
+            except sqlite3.OperationalError as e:
+                print(f"⚠️ Job claim failed: {e}")
+                row = None
+            if row is None:
+                with self._queued:
+                    self._queued.wait(JOB_POLL_INTERVAL)
+                continue
+            self._run_job(row)
+
+    def purge_finished(self, older_than=JOB_RETENTION):
+        self._conn().execute(
+            "DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ?", (time.time() - older_than,)
+        )
+
+    def start(self):
+        if self._threads:
+            return
+        self.purge_finished()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker_loop, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        print(f"🧵 Job queue started with {self.workers} workers ({self.path})")
+
+    def stop(self, timeout=None):
+        self._stop_event.set()
+        for cond in (self._queued, self._finished):
+            with cond:
+                cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def stats(self):
+        rows = self._conn().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {"workers": len(self._threads), **{status: n for status, n in rows}}
@@ -0,0 +1,212 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from firebase_utils import get_firestore
+
+LLM_CACHE_BACKEND = os.getenv("LLM_CACHE_BACKEND", "sqlite")  # memory | sqlite | firestore
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "llm_cache.sqlite3")
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "10000"))
+LLM_CACHE_MEMORY_SIZE = int(os.getenv("LLM_CACHE_MEMORY_SIZE", "1000"))
+
+
+def _normalize(value):
+    if isinstance(value, str):
+        return re.sub(r"\s+", " ", value).strip()
+    return json.dumps(value, sort_keys=True, separators=(",", ":"))
+
+
+def make_key(kind, *parts):
+    """
+    Content-address an LLM call by its kind and normalized prompt inputs.
+    """
+    digest = hashlib.sha256(kind.encode("utf-8"))
+    for part in parts:
+        digest.update(b"\x00")
+        digest.update(_normalize(part).encode("utf-8"))
+    return f"{kind}:{digest.hexdigest()}"
+
+
+class MemoryBackend:
+    """
+    Size-bounded LRU with per-entry expiry.
+    """
+
+    def __init__(self, max_size=LLM_CACHE_MEMORY_SIZE):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (value, time.time() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+
+class SQLiteBackend:
+    """
+    Local persistent store. Expired rows are purged and the least recently
+    used rows are evicted once the table grows past `max_size`.
+    """
+
+    def __init__(self, path=LLM_CACHE_PATH, max_size=LLM_CACHE_SIZE):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_last_access ON llm_cache (last_access)")
+        self._conn.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            return row[0]
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, expires_at, last_access) VALUES (?, ?, ?, ?)",
+                (key, value, now + ttl, now)
+            )
+            self._conn.execute("DELETE FROM llm_cache WHERE expires_at < ?", (now,))
+            self._conn.execute(
+                "DELETE FROM llm_cache WHERE key IN ("
+                "SELECT key FROM llm_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_size,)
+            )
+            self._conn.commit()
+
+
+class FirestoreBackend:
+    """
+    Shared store in the `llm_cache` collection. Expiry is checked on read;
+    pair it with a Firestore TTL policy on `expires_at` to bound its size.
+    """
+
+    def __init__(self, collection="llm_cache"):
+        self.collection = collection
+
+    def get(self, key):
+        doc = get_firestore().collection(self.collection).document(key).get()
+        if not doc.exists:
+            return None
+        data = doc.to_dict()
+        if data.get("expires_at", 0) < time.time():
+            return None
+        return data.get("value")
+
+    def set(self, key, value, ttl):
+        get_firestore().collection(self.collection).document(key).set({
+            "value": value,
+            "expires_at": time.time() + ttl
+        })
+
+
+class LLMCache:
+    """
+    In-memory LRU in front of an optional persistent backend, with hit/miss counters.
+    """
+
+    def __init__(self, store=None, ttl=LLM_CACHE_TTL):
+        self.memory = MemoryBackend()
+        self.store = store
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is None and self.store is not None:
+            try:
+                value = self.store.get(key)
+            except Exception as e:
+                print(f"⚠️ LLM cache read failed: {e}")
+                value = None
+            if value is not None:
+                self.memory.set(key, value, self.ttl)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self.memory.set(key, value, self.ttl)
+        if self.store is not None:
+            try:
+                self.store.set(key, value, self.ttl)
+            except Exception as e:
+                print(f"⚠️ LLM cache write failed: {e}")
+
+    def get_or_call(self, key, fn):
+        """
+        Return the cached completion for `key`, or call `fn()` and cache its result.
+        """
+        value = self.get(key)
+        if value is None:
+            value = fn()
+            if value is not None:
+                self.set(key, value)
+        return value
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "backend": type(self.store).__name__ if self.store else "MemoryBackend",
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else None
+            }
+
+
+def _make_store(backend):
+    if backend == "sqlite":
+        return SQLiteBackend()
+    if backend == "firestore":
+        return FirestoreBackend()
+    return None
+
+
+llm_cache = LLMCache(_make_store(LLM_CACHE_BACKEND))
+
+
+def get_cache_stats():
+    return llm_cache.stats()
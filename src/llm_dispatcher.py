@@ -0,0 +1,181 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+import openai
+from openai import AsyncOpenAI
+from dotenv import load_dotenv
+
+load_dotenv()
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-4")
+LLM_TPM = int(os.getenv("LLM_TPM", "40000"))
+LLM_RPM = int(os.getenv("LLM_RPM", "500"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "5"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "1.0"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "30"))
+LLM_EST_COMPLETION_TOKENS = int(os.getenv("LLM_EST_COMPLETION_TOKENS", "300"))
+
+
+def estimate_tokens(messages):
+    chars = sum(len(m.get("content") or "") for m in messages)
+    return chars // 4 + LLM_EST_COMPLETION_TOKENS
+
+
+def is_retryable(error):
+    if isinstance(error, openai.APIConnectionError):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return False
+
+
+class TokenBucket:
+    """
+    Refills `per_minute` units per minute up to `capacity`. Only used from
+    the dispatcher's event loop, so it needs no locking.
+    """
+
+    def __init__(self, per_minute, capacity=None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity or per_minute
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount=1):
+        amount = min(amount, self.capacity)
+        while True:
+            self._refill()
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return
+            await asyncio.sleep((amount - self.tokens) / self.rate)
+
+    def adjust(self, delta):
+        """
+        Charge (or refund) the difference between estimated and actual usage.
+        """
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - delta)
+
+
+class LLMDispatcher:
+    """
+    Process-wide gateway for chat completions.
+
+    Requests run on one asyncio loop in a background thread with a single
+    shared client, bounded concurrency, org-wide token/request buckets,
+    jittered exponential backoff on 429/5xx, and coalescing of identical
+    in-flight requests. Callers stay synchronous via `complete()`.
+    """
+
+    def __init__(self, tpm=LLM_TPM, rpm=LLM_RPM, max_concurrency=LLM_MAX_CONCURRENCY,
+                 max_retries=LLM_MAX_RETRIES):
+        self.tpm = tpm
+        self.rpm = rpm
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self._loop = None
+        self._start_lock = threading.Lock()
+        self._inflight = {}
+        self._stats = {"requests": 0, "completed": 0, "coalesced": 0, "retries": 0, "errors": 0}
+
+    def _ensure_loop(self):
+        if self._loop is not None:
+            return self._loop
+        with self._start_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="llm-dispatcher", daemon=True).start()
+                asyncio.run_coroutine_threadsafe(self._init(), loop).result()
+                self._loop = loop
+        return self._loop
+
+    async def _init(self):
+        self._client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._token_bucket = TokenBucket(self.tpm)
+        self._request_bucket = TokenBucket(self.rpm)
+
+    def submit(self, messages, model=LLM_MODEL, **kwargs):
+        """
+        Schedule a chat completion and return a concurrent.futures.Future for its content.
+        """
+        loop = self._ensure_loop()
+        return asyncio.run_coroutine_threadsafe(self._dispatch(messages, model, kwargs), loop)
+
+    def complete(self, prompt, model=LLM_MODEL, **kwargs):
+        """
+        Blocking helper: send a single user prompt and return the reply text.
+        """
+        return self.submit([{"role": "user", "content": prompt}], model, **kwargs).result()
+
+    async def _dispatch(self, messages, model, kwargs):
+        self._stats["requests"] += 1
+        key = hashlib.sha256(
+            json.dumps([model, messages, kwargs], sort_keys=True, default=str).encode("utf-8")
+        ).hexdigest()
+        task = self._inflight.get(key)
+        if task is not None:
+            self._stats["coalesced"] += 1
+        else:
+            task = asyncio.ensure_future(self._call_with_retry(messages, model, kwargs))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _call_with_retry(self, messages, model, kwargs):
+        estimated = estimate_tokens(messages)
+        attempt = 0
+        while True:
+            await self._request_bucket.acquire()
+            await self._token_bucket.acquire(estimated)
+            try:
+                async with self._semaphore:
+                    response = await self._client.chat.completions.create(
+                        model=model, messages=messages, **kwargs
+                    )
+            except Exception as e:
+                if not is_retryable(e) or attempt >= self.max_retries:
+                    self._stats["errors"] += 1
+                    raise
+                attempt += 1
+                self._stats["retries"] += 1
+                delay = random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))
+                print(f"⏳ LLM request failed ({e.__class__.__name__}), retry {attempt} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+
+            usage = getattr(response, "usage", None)
+            if usage is not None and usage.total_tokens:
+                self._token_bucket.adjust(usage.total_tokens - estimated)
+            self._stats["completed"] += 1
+            return response.choices[0].message.content
+
+    def stats(self):
+        return {
+            **self._stats,
+            "in_flight": len(self._inflight),
+            "max_concurrency": self.max_concurrency,
+            "tpm": self.tpm,
+            "rpm": self.rpm
+        }
+
+
+dispatcher = LLMDispatcher()
+
+
+def complete(prompt, model=LLM_MODEL, **kwargs):
+    return dispatcher.complete(prompt, model, **kwargs)
+
+
+def get_dispatcher_stats():
+    return dispatcher.stats()
@@ -0,0 +1,82 @@
+import os
+import re
+import threading
+from collections import Counter
+from confirmation_tracker import get_pending_confirmation
+
+ALTERNATES_SUBJECT = "Alternate meeting time suggestions"
+# Comma-separated addresses or @domains that never carry meeting requests
+IGNORED_SENDERS = {s.strip().lower() for s in os.getenv("IGNORED_SENDERS", "").split(",") if s.strip()}
+AUTOMATED_SENDER = re.compile(r"^(no-?reply|do-?not-?reply|mailer-daemon|postmaster|notifications?|bounce[s]?)[@+.-]", re.IGNORECASE)
+REPLY_PREFIX = re.compile(r"^\s*((re|aw|sv|fwd?)\s*:\s*)+", re.IGNORECASE)
+
+_stats = Counter()
+_lock = threading.Lock()
+
+
+def _count(key):
+    with _lock:
+        _stats[key] += 1
+
+
+def _is_ignored_sender(sender_email):
+    sender_email = sender_email.lower()
+    domain = "@" + sender_email.rsplit("@", 1)[-1]
+    return sender_email in IGNORED_SENDERS or domain in IGNORED_SENDERS or bool(AUTOMATED_SENDER.match(sender_email))
+
+
+def _is_bulk(headers):
+    if "list-unsubscribe" in headers:
+        return True
+    if headers.get("precedence", "").lower() in ("bulk", "list", "junk"):
+        return True
+    return headers.get("auto-submitted", "no").lower() != "no"
+
+
+def _is_alternates_reply(headers):
+    subject = headers.get("subject", "")
+    return bool(REPLY_PREFIX.match(subject)) and REPLY_PREFIX.sub("", subject).strip() == ALTERNATES_SUBJECT
+
+
+def classify_message(uid, meta):
+    """
+    Decide from headers alone how a message is routed.
+
+    Returns ("reply", pending) when the sender has a pending proposal,
+    ("event", None) for messages worth a full fetch and parse, and
+    ("skip", reason) for mail that is dropped without fetching the body.
+    """
+    sender_email = meta.get("sender_email")
+    headers = meta.get("headers", {})
+    if not sender_email:
+        route = ("skip", "no_sender")
+    else:
+        pending = get_pending_confirmation(uid, sender_email)
+        if pending:
+            route = ("reply", pending)
+        elif _is_alternates_reply(headers):
+            # Reply on our own suggestions thread with nothing left to confirm
+            route = ("skip", "stale_reply")
+        elif _is_bulk(headers):
+            route = ("skip", "bulk")
+        elif _is_ignored_sender(sender_email):
+            route = ("skip", "ignored_sender")
+        else:
+            route = ("event", None)
+
+    _count(route[1] if route[0] == "skip" else route[0])
+    return route
+
+
+def get_filter_stats():
+    with _lock:
+        stats = dict(_stats)
+    classified = sum(stats.values())
+    skipped = classified - stats.get("reply", 0) - stats.get("event", 0)
+    return {
+        "classified": classified,
+        "full_fetches": classified - skipped,
+        "skipped": skipped,
+        "skip_rate": skipped / classified if classified else 0.0,
+        "by_route": stats
+    }
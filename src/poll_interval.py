@@ -0,0 +1,34 @@
+import os
+import random
+
+POLL_INTERVAL = float(os.getenv("AGENT_POLL_INTERVAL", "60"))
+POLL_MIN_INTERVAL = float(os.getenv("AGENT_POLL_MIN_INTERVAL", "15"))
+POLL_MAX_INTERVAL = float(os.getenv("AGENT_POLL_MAX_INTERVAL", "600"))
+POLL_BACKOFF = float(os.getenv("AGENT_POLL_BACKOFF", "2"))
+POLL_JITTER = float(os.getenv("AGENT_POLL_JITTER", "0.1"))
+
+
+class AdaptiveInterval:
+    """
+    Per-user poll interval: drops to the minimum after a cycle that found mail
+    and backs off exponentially (capped, with jitter) while the inbox is quiet.
+    """
+
+    def __init__(self, initial=POLL_INTERVAL, minimum=POLL_MIN_INTERVAL, maximum=POLL_MAX_INTERVAL,
+                 backoff=POLL_BACKOFF, jitter=POLL_JITTER):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.backoff = backoff
+        self.jitter = jitter
+        self.current = min(max(initial, minimum), maximum)
+
+    def next_delay(self, activity):
+        """
+        Update the interval from the last cycle's outcome and return the jittered delay.
+        """
+        if activity:
+            self.current = self.minimum
+        else:
+            self.current = min(self.current * self.backoff, self.maximum)
+        spread = self.current * self.jitter
+        return max(self.minimum, self.current + random.uniform(-spread, spread))
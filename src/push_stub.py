@@ -0,0 +1,37 @@
+"""
+Send a fake Gmail Pub/Sub push notification to a locally running app.
+
+    python src/push_stub.py user@gmail.com [--history-id 12345] [--url http://localhost:5000/gmail/push]
+"""
+import argparse
+import base64
+import json
+import os
+import urllib.request
+
+
+def build_envelope(email_address, history_id):
+    data = json.dumps({"emailAddress": email_address, "historyId": history_id}).encode("utf-8")
+    return {
+        "message": {"data": base64.b64encode(data).decode("ascii"), "messageId": "stub-1"},
+        "subscription": "projects/local/subscriptions/gmail-push-stub"
+    }
+
+
+def send_push(url, email_address, history_id, token=None):
+    if token:
+        url = f"{url}?token={token}"
+    body = json.dumps(build_envelope(email_address, history_id)).encode("utf-8")
+    req = urllib.request.Request(url, data=body, headers={"Content-Type": "application/json"}, method="POST")
+    with urllib.request.urlopen(req) as resp:
+        return resp.status
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("email_address")
+    parser.add_argument("--history-id", default="0")
+    parser.add_argument("--url", default="http://localhost:5000/gmail/push")
+    args = parser.parse_args()
+    status = send_push(args.url, args.email_address, args.history_id, os.getenv("PUBSUB_VERIFICATION_TOKEN"))
+    print(f"📨 Stub push sent, status {status}")
@@ -1,16 +1,16 @@
-import os
-import re
 import json
-from openai import OpenAI
 from confirmation_tracker import (
     get_pending_confirmation,
     remove_pending_confirmation
 )
 from calendar_scheduler import schedule_event
-from email_reader import extract_body
+from email_reader import fetch_messages, fetch_metadata, mark_all_as_read
+from gmail_sync import list_unread_message_ids
 from activity_logger import log_user_activity
+from llm_cache import llm_cache, make_key
+from llm_dispatcher import complete
+from structured_output import CONFIRMATION_SCHEMA, response_format, parse_confirmation_output
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
 def parse_confirmation_reply(reply_text, options):
     """
@@ -31,65 +31,60 @@ Respond with only the selected option as JSON. Use exact values from the origina
 If no option matches, return: null
 """
 
-    response = client.chat.completions.create(
-        model="gpt-4",
-        messages=[{"role": "user", "content": prompt}]
+    content = llm_cache.get_or_call(
+        make_key("confirmation_reply", reply_text, options),
+        lambda: complete(prompt, **response_format("confirmation_reply", CONFIRMATION_SCHEMA))
     )
+    return parse_confirmation_output(content, options)
 
-    content = response.choices[0].message.content.strip()
-    try:
-        return json.loads(content)
-    except:
-        return None
-
-def process_replies(gmail_service, calendar_service, uid):
+def handle_confirmation_reply(gmail_service, calendar_service, uid, sender_email, reply_text, pending):
     """
-    Check unread emails for replies to suggested meeting options and schedule confirmed slots.
+    Match a reply against the pending options for its sender and schedule the chosen slot.
     """
-    print("📥 Checking replies to suggested meeting options...")
-    results = gmail_service.users().messages().list(userId='me', labelIds=['INBOX'], q="is:unread", maxResults=5).execute()
-    messages = results.get('messages', [])
+    print(f"📨 Reply from {sender_email}:\n{reply_text[:300]}...\n")
 
-    for msg in messages:
-        full_msg = gmail_service.users().messages().get(userId='me', id=msg['id'], format='full').execute()
-        headers = full_msg.get("payload", {}).get("headers", [])
-        payload = full_msg.get("payload", {})
-        sender_email = next((h['value'] for h in headers if h['name'].lower() == 'from'), None)
+    log_user_activity(uid, "ReplyReceived", f"Received reply from {sender_email}")
 
-        if sender_email:
-            match = re.search(r'<(.+?)>', sender_email)
-            if match:
-                sender_email = match.group(1)
-
-            pending = get_pending_confirmation(sender_email)
-            if pending:
-                reply_text = extract_body(payload)
-                print(f"📨 Reply from {sender_email}:\n{reply_text[:300]}...\n")
+    selected = parse_confirmation_reply(reply_text, pending['options'])
 
-                log_user_activity(uid, "ReplyReceived", f"Received reply from {sender_email}")
+    if selected:
+        event_info = {
+            "title": "Confirmed Meeting",
+            "date": selected['date'],
+            "start": selected['start'],
+            "end": selected['end']
+        }
 
-                selected = parse_confirmation_reply(reply_text, pending['options'])
+        schedule_event(calendar_service, event_info, sender_email=sender_email, gmail_service=gmail_service, uid=uid)
+        remove_pending_confirmation(uid, sender_email)
 
-                if selected:
-                    event_info = {
-                        "title": "Confirmed Meeting",
-                        "date": selected['date'],
-                        "start": selected['start'],
-                        "end": selected['end']
-                    }
+        log_user_activity(uid, "EventScheduled", f"Confirmed slot for {sender_email} on {selected['date']} at {selected['start']}")
+        print(f"✅ Scheduled confirmed slot for {sender_email}.")
+    else:
+        log_user_activity(uid, "ReplyUnmatched", f"Could not interpret reply from {sender_email}")
+        print("⚠️ Could not match a valid option from reply.")
 
-                    schedule_event(calendar_service, event_info, sender_email=sender_email, gmail_service=gmail_service)
-                    remove_pending_confirmation(sender_email)
+def process_replies(gmail_service, calendar_service, uid):
+    """
+    Check the latest unread emails for replies to suggested meeting options and schedule confirmed slots.
+    The agent loop routes replies itself; this is used by the /check-replies endpoint.
+    """
+    print("📥 Checking replies to suggested meeting options...")
+    message_ids = list_unread_message_ids(gmail_service)
+    # Only senders with a pending proposal need their full message fetched
+    pending_by_id = {}
+    for meta in fetch_metadata(gmail_service, message_ids):
+        if meta["sender_email"]:
+            pending = get_pending_confirmation(uid, meta["sender_email"])
+            if pending:
+                pending_by_id[meta["id"]] = pending
 
-                    log_user_activity(uid, "EventScheduled", f"Confirmed slot for {sender_email} on {selected['date']} at {selected['start']}")
-                    print(f"✅ Scheduled confirmed slot for {sender_email}.")
-                else:
-                    log_user_activity(uid, "ReplyUnmatched", f"Could not interpret reply from {sender_email}")
-                    print("⚠️ Could not match a valid option from reply.")
+    handled = []
+    for message in fetch_messages(gmail_service, list(pending_by_id)):
+        handle_confirmation_reply(gmail_service, calendar_service, uid, message["sender_email"], message["body"],
+                                  pending_by_id[message["id"]])
+        handled.append(message["id"])
 
-        # Mark the email as read after processing
-        gmail_service.users().messages().modify(
-            userId='me',
-            id=msg['id'],
-            body={'removeLabelIds': ['UNREAD']}
-        ).execute()
+    # Only mark the replies handled here; other unread mail is left for the agent
+    if handled:
+        mark_all_as_read(gmail_service, handled)
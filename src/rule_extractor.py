@@ -0,0 +1,213 @@
+import re
+from datetime import datetime, timedelta
+
+DEFAULT_DURATION = timedelta(hours=1)
+
+MONTHS = {
+    "jan": 1, "feb": 2, "mar": 3, "apr": 4, "may": 5, "jun": 6,
+    "jul": 7, "aug": 8, "sep": 9, "oct": 10, "nov": 11, "dec": 12
+}
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+MONTH_RE = (r"\b(jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|may|june?|july?|aug(?:ust)?"
+            r"|sep(?:t(?:ember)?)?|oct(?:ober)?|nov(?:ember)?|dec(?:ember)?)\b\.?")
+
+# (pattern, title) in order of specificity; the first hit names the event
+INTENT_TITLES = [
+    (r"\bcatch(?:ing)?[\s-]?up\b", "Catch Up"),
+    (r"\bstand[\s-]?up\b", "Standup"),
+    (r"\bsync\b", "Sync"),
+    (r"\binterview\b", "Interview"),
+    (r"\bdemo\b", "Demo"),
+    (r"\blunch\b", "Lunch"),
+    (r"\bcoffee\b", "Coffee Chat"),
+    (r"\b(?:quick |phone |video |zoom )?call\b", "Call"),
+    (r"\bappointment\b", "Appointment"),
+    (r"\bdiscuss(?:ion)?\b", "Discussion"),
+    (r"\bconnect\b", "Connect"),
+    (r"\breview\b", "Review"),
+    (r"\bmeet(?:ing|up)?\b", "Meeting"),
+    (r"\bschedul(?:e|ing)\b", "Meeting"),
+]
+BULK_MARKERS = re.compile(
+    r"\bunsubscribe\b|view (?:this email )?in (?:your )?browser|\breceipt\b|\binvoice\b"
+    r"|\border (?:#|number|confirmation)|\bnewsletter\b|\bno[\s-]?reply\b",
+    re.IGNORECASE
+)
+
+# Cancellations, declines and reschedules must not turn into new invites; the LLM handles them
+CHANGE_MARKERS = re.compile(
+    r"\bcancel\w*|\bdeclin\w*|\breschedul\w*|\bpostpon\w*|\bmov(?:e|ed|ing)\b|\bunable\b"
+    r"|\bcan(?:no|['’])?t\b|\bwon['’]?t\b|n['’]t\b|\bnot\b",
+    re.IGNORECASE
+)
+
+ISO_DATE = re.compile(r"\b(\d{4})-(\d{2})-(\d{2})\b")
+MONTH_DAY = re.compile(MONTH_RE + r"\s+(\d{1,2})(?:st|nd|rd|th)?\b(?:,?\s+(\d{4}))?", re.IGNORECASE)
+DAY_MONTH = re.compile(r"\b(\d{1,2})(?:st|nd|rd|th)?\s+(?:of\s+)?" + MONTH_RE + r"(?:,?\s+(\d{4}))?", re.IGNORECASE)
+RELATIVE_DAY = re.compile(r"\b(day after tomorrow|tomorrow|today|tonight)\b", re.IGNORECASE)
+WEEKDAY = re.compile(r"\b(?:(next|this|coming)\s+)?(" + "|".join(WEEKDAYS) + r")\b", re.IGNORECASE)
+
+_T = r"(\d{1,2})(?::(\d{2}))?\s*([ap]\.?m\.?)?"
+TIME_RANGE = re.compile(r"\b" + _T + r"\s*(?:-|–|to|until|till)\s*" + _T + r"(?![\w:])", re.IGNORECASE)
+TIME_SINGLE = re.compile(r"\b(\d{1,2})(?::(\d{2}))?\s*([ap]\.?m\.?)(?!\w)|\b(\d{1,2}):(\d{2})\b|\b(noon)\b", re.IGNORECASE)
+
+
+def detect_intent(text):
+    """
+    Return the event title implied by the first meeting-intent keyword, or None.
+    """
+    lowered = text.lower()
+    for pattern, title in INTENT_TITLES:
+        if re.search(pattern, lowered):
+            return title
+    return None
+
+
+def _safe_date(year, month, day):
+    try:
+        return datetime(year, month, day).date()
+    except ValueError:
+        return None
+
+
+def _upcoming_weekday(today, weekday, qualifier):
+    days_ahead = (weekday - today.weekday()) % 7 or 7
+    target = today + timedelta(days=days_ahead)
+    if qualifier and qualifier.lower() == "next" and target.isocalendar()[1] == today.isocalendar()[1]:
+        target += timedelta(days=7)
+    return target
+
+
+def find_dates(text, today):
+    """
+    Return (dates, spans): distinct dates mentioned in the text and the character spans they came from.
+    """
+    dates = []
+    spans = []
+
+    def add(date, match):
+        spans.append(match.span())
+        if date and date not in dates:
+            dates.append(date)
+
+    for m in ISO_DATE.finditer(text):
+        add(_safe_date(int(m.group(1)), int(m.group(2)), int(m.group(3))), m)
+    for regex, month_group, day_group in ((MONTH_DAY, 1, 2), (DAY_MONTH, 2, 1)):
+        for m in regex.finditer(text):
+            if m.group(month_group) == "may":
+                # Lower-case "may" is almost always the verb ("you may 3 times ...")
+                continue
+            month = MONTHS[m.group(month_group).lower()[:3]]
+            day = int(m.group(day_group))
+            if m.group(3):
+                date = _safe_date(int(m.group(3)), month, day)
+            else:
+                date = _safe_date(today.year, month, day)
+                if date and date < today:
+                    date = _safe_date(today.year + 1, month, day)
+            add(date, m)
+    for m in RELATIVE_DAY.finditer(text):
+        word = m.group(1).lower()
+        offset = {"today": 0, "tonight": 0, "tomorrow": 1, "day after tomorrow": 2}[word]
+        add(today + timedelta(days=offset), m)
+    for m in WEEKDAY.finditer(text):
+        add(_upcoming_weekday(today, WEEKDAYS.index(m.group(2).lower()), m.group(1)), m)
+    return dates, spans
+
+
+def _to_minutes(hour, minute, meridiem):
+    hour = int(hour)
+    minute = int(minute or 0)
+    if meridiem:
+        meridiem = meridiem.lower()[0]
+        if hour < 1 or hour > 12:
+            return None
+        if meridiem == "p" and hour != 12:
+            hour += 12
+        elif meridiem == "a" and hour == 12:
+            hour = 0
+    if hour > 23 or minute > 59:
+        return None
+    return hour * 60 + minute
+
+
+def _format_minutes(minutes):
+    return f"{minutes // 60:02}:{minutes % 60:02}"
+
+
+def find_times(text):
+    """
+    Return distinct (start, end) pairs in HH:MM. Single times get DEFAULT_DURATION.
+    Bare numbers only count as times when a side has am/pm or a colon.
+    """
+    times = []
+    taken = []
+
+    for m in TIME_RANGE.finditer(text):
+        h1, m1, ap1, h2, m2, ap2 = m.groups()
+        if not (ap1 or ap2 or m1 or m2):
+            continue
+        end = _to_minutes(h2, m2, ap2)
+        start = _to_minutes(h1, m1, ap1 or ap2)
+        if start is not None and end is not None and start >= end and not ap1 and ap2:
+            # "11-1pm": the start belongs to the other half of the day
+            start = _to_minutes(h1, m1, "am" if ap2.lower().startswith("p") else "pm")
+        if start is None or end is None or start >= end:
+            continue
+        taken.append(m.span())
+        pair = (_format_minutes(start), _format_minutes(end))
+        if pair not in times:
+            times.append(pair)
+
+    for m in TIME_SINGLE.finditer(text):
+        if any(s <= m.start() < e for s, e in taken):
+            continue
+        if m.group(6):
+            start = 12 * 60
+        elif m.group(3):
+            start = _to_minutes(m.group(1), m.group(2), m.group(3))
+        else:
+            start = _to_minutes(m.group(4), m.group(5), None)
+        if start is None:
+            continue
+        end = min(start + int(DEFAULT_DURATION.total_seconds() // 60), 23 * 60 + 59)
+        pair = (_format_minutes(start), _format_minutes(end))
+        if pair not in times:
+            times.append(pair)
+    return times
+
+
+def _blank_spans(text, spans):
+    chars = list(text)
+    for start, end in spans:
+        for i in range(start, end):
+            chars[i] = " "
+    return "".join(chars)
+
+
+def classify_email(text, now=None):
+    """
+    Decide how an email should be parsed without calling the LLM.
+
+    Returns ("rule", event_dict) when exactly one future date and time slot
+    accompany a meeting-intent keyword and nothing cancels or moves it, ("skip", None) when the email has no
+    date, time or intent at all, and ("llm", None) for everything in between.
+    """
+    now = now or datetime.now()
+    today = now.date()
+    title = detect_intent(text)
+    dates, date_spans = find_dates(text, today)
+    times = find_times(_blank_spans(text, date_spans))
+
+    if not title and not times and not dates:
+        return "skip", None
+    if BULK_MARKERS.search(text) and not (title and times):
+        return "skip", None
+    if not title or len(dates) != 1 or len(times) != 1 or CHANGE_MARKERS.search(text):
+        return "llm", None
+
+    date = dates[0]
+    start, end = times[0]
+    if date < today or (date == today and start <= now.strftime("%H:%M")):
+        return "llm", None
+    return "rule", {"title": title, "date": date.isoformat(), "start": start, "end": end}
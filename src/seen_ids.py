@@ -0,0 +1,52 @@
+import os
+from collections import OrderedDict
+
+SEEN_IDS_LIMIT = int(os.getenv("SEEN_IDS_LIMIT", "500"))
+
+
+class SeenIds:
+    """
+    Insertion-ordered, bounded set of processed Gmail message IDs.
+    Adding past `maxlen` evicts the oldest IDs, never arbitrary ones, and
+    `dirty` records whether anything changed since the last save.
+    """
+
+    def __init__(self, ids=(), maxlen=SEEN_IDS_LIMIT):
+        self.maxlen = maxlen
+        self._ids = OrderedDict()
+        for msg_id in ids:
+            self._ids[msg_id] = None
+        self._evict()
+        self.dirty = False
+        # Loaded from the old google_creds.seen_ids field, which should be removed on save
+        self.legacy = False
+
+    def _evict(self):
+        while len(self._ids) > self.maxlen:
+            self._ids.popitem(last=False)
+
+    def __contains__(self, msg_id):
+        return msg_id in self._ids
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __iter__(self):
+        return iter(self._ids)
+
+    def add(self, msg_id):
+        if msg_id in self._ids:
+            return
+        self._ids[msg_id] = None
+        self._evict()
+        self.dirty = True
+
+    def update(self, msg_ids):
+        for msg_id in msg_ids:
+            self.add(msg_id)
+
+    def to_list(self):
+        """
+        IDs oldest first, so reloading preserves eviction order.
+        """
+        return list(self._ids)
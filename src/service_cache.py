@@ -0,0 +1,207 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from google.oauth2.credentials import Credentials as GoogleCredentials
+from googleapiclient.discovery import build
+from googleapiclient.http import HttpRequest, build_http
+import google.auth.transport.requests
+import google_auth_httplib2
+from firebase_utils import get_firestore
+from user_repository import user_repository
+
+SERVICE_CACHE_SIZE = int(os.getenv("SERVICE_CACHE_SIZE", "1000"))
+SERVICE_CACHE_TTL = float(os.getenv("SERVICE_CACHE_TTL", "3600"))
+TOKEN_REFRESH_MARGIN = float(os.getenv("TOKEN_REFRESH_MARGIN", "300"))
+TOKEN_REFRESH_INTERVAL = float(os.getenv("TOKEN_REFRESH_INTERVAL", "60"))
+
+DEFAULT_SCOPES = [
+    "https://www.googleapis.com/auth/gmail.modify",
+    "https://www.googleapis.com/auth/calendar",
+    "https://www.googleapis.com/auth/gmail.send",
+    "https://www.googleapis.com/auth/gmail.readonly"
+]
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+_refresher = None
+
+
+class CachedServices:
+    """
+    A user's credentials and Gmail/Calendar services, built once and shared
+    by every thread. Requests run on a per-thread authorized transport:
+    httplib2.Http, which the services would otherwise share, is not thread-safe.
+    """
+
+    def __init__(self, creds):
+        self.creds = creds
+        self.created_at = time.monotonic()
+        self.lock = threading.Lock()
+        self._local = threading.local()
+        # Static discovery documents ship with google-api-python-client, so nothing is fetched here
+        self.gmail = build("gmail", "v1", credentials=creds, requestBuilder=self._request,
+                           static_discovery=True, cache_discovery=False)
+        self.calendar = build("calendar", "v3", credentials=creds, requestBuilder=self._request,
+                              static_discovery=True, cache_discovery=False)
+
+    def http(self):
+        http = getattr(self._local, "http", None)
+        if http is None:
+            http = self._local.http = google_auth_httplib2.AuthorizedHttp(self.creds, http=build_http())
+        return http
+
+    def _request(self, http, *args, **kwargs):
+        # Ignore the service's shared transport; batches reuse the transport of their first request
+        return HttpRequest(self.http(), *args, **kwargs)
+
+
+def build_credentials(uid, creds_data):
+    """
+    Build GoogleCredentials from the google_creds map stored in Firestore.
+    """
+    # ✅ Support both new (access_token) and legacy (token) field
+    token = creds_data.get("access_token") or creds_data.get("token")
+    if not token:
+        raise Exception(f"Missing access token for uid={uid}")
+
+    expiry = None
+    if creds_data.get("expiry"):
+        try:
+            expiry = datetime.fromisoformat(str(creds_data["expiry"]))
+        except ValueError:
+            expiry = None
+
+    return GoogleCredentials(
+        token=token,
+        refresh_token=creds_data.get("refresh_token"),
+        token_uri=creds_data.get("token_uri", "https://oauth2.googleapis.com/token"),
+        client_id=creds_data.get("client_id") or os.environ.get("GOOGLE_CLIENT_ID"),
+        client_secret=creds_data.get("client_secret") or os.environ.get("GOOGLE_CLIENT_SECRET"),
+        scopes=creds_data.get("scopes") or DEFAULT_SCOPES,
+        expiry=expiry
+    )
+
+
+def save_refreshed_token(uid, creds):
+    db = get_firestore()
+    updates = {
+        "google_creds.access_token": creds.token,
+        "google_creds.expiry": creds.expiry.isoformat() if creds.expiry else None
+    }
+    try:
+        db.collection("users").document(uid).update(updates)
+        user_repository.note_write(uid, updates)
+    except Exception as e:
+        print(f"⚠️ Failed to save refreshed token for UID {uid}: {e}")
+
+
+def refresh_credentials(uid, entry):
+    """
+    Refresh the cached credentials and write the new token back to Firestore.
+    """
+    with entry.lock:
+        if not entry.creds.refresh_token:
+            return False
+        entry.creds.refresh(google.auth.transport.requests.Request())
+    save_refreshed_token(uid, entry.creds)
+    print(f"🔑 Refreshed Google token for {uid}")
+    return True
+
+
+def _needs_refresh(creds, margin=TOKEN_REFRESH_MARGIN):
+    if creds.expiry is None:
+        return False
+    return creds.expiry - timedelta(seconds=margin) <= datetime.utcnow()
+
+
+def _build_entry(uid, creds_data, refresh=True):
+    creds = build_credentials(uid, creds_data)
+    entry = CachedServices(creds)
+    if refresh and creds.refresh_token and (creds.expired or _needs_refresh(creds)):
+        refresh_credentials(uid, entry)
+    return entry
+
+
+def _load_entry(uid):
+    user = user_repository.get(uid, ["google_creds"])
+    if user is None:
+        raise Exception(f"No stored credentials for uid={uid}")
+    creds_data = user.get("google_creds")
+    if not creds_data:
+        raise Exception("Missing google_creds in Firestore")
+    return _build_entry(uid, creds_data)
+
+
+def _store_entry(uid, entry):
+    with _lock:
+        _cache[uid] = entry
+        _cache.move_to_end(uid)
+        while len(_cache) > SERVICE_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def get_services(uid):
+    """
+    Return cached (gmail, calendar) services for a user, safe to share across threads.
+    Entries are reloaded on a miss or once older than SERVICE_CACHE_TTL.
+    """
+    _start_refresher()
+    with _lock:
+        entry = _cache.get(uid)
+        if entry and time.monotonic() - entry.created_at < SERVICE_CACHE_TTL:
+            _cache.move_to_end(uid)
+        else:
+            entry = None
+
+    if entry is None:
+        entry = _load_entry(uid)
+        _store_entry(uid, entry)
+    return entry.gmail, entry.calendar
+
+
+def preload(uid, creds_data):
+    """
+    Warm the cache from google_creds that were already read (e.g. by a batched get_all).
+    Expired tokens are left to the first request or the background refresher.
+    """
+    _start_refresher()
+    _store_entry(uid, _build_entry(uid, creds_data, refresh=False))
+
+
+def invalidate(uid):
+    """
+    Drop a user's cached services, e.g. after new credentials are stored.
+    """
+    with _lock:
+        _cache.pop(uid, None)
+
+
+def refresh_expiring_tokens(margin=TOKEN_REFRESH_MARGIN):
+    with _lock:
+        entries = list(_cache.items())
+    for uid, entry in entries:
+        if not _needs_refresh(entry.creds, margin):
+            continue
+        try:
+            refresh_credentials(uid, entry)
+        except Exception as e:
+            print(f"⚠️ Token refresh failed for {uid}: {e}")
+            invalidate(uid)
+
+
+def _refresh_loop():
+    while True:
+        time.sleep(TOKEN_REFRESH_INTERVAL)
+        refresh_expiring_tokens()
+
+
+def _start_refresher():
+    global _refresher
+    if _refresher is not None:
+        return
+    with _lock:
+        if _refresher is None:
+            _refresher = threading.Thread(target=_refresh_loop, name="token-refresher", daemon=True)
+            _refresher.start()
@@ -0,0 +1,118 @@
+import os
+from bisect import bisect_left
+from datetime import datetime, timedelta
+
+WORK_START_HOUR = int(os.getenv("WORK_START_HOUR", "9"))
+WORK_END_HOUR = int(os.getenv("WORK_END_HOUR", "18"))
+SLOT_STEP_MINUTES = int(os.getenv("SLOT_STEP_MINUTES", "30"))
+SLOT_SEARCH_DAYS = int(os.getenv("SLOT_SEARCH_DAYS", "5"))
+SKIP_WEEKENDS = os.getenv("SKIP_WEEKENDS", "1") == "1"
+
+
+def parse_rfc3339(value):
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+class BusyIndex:
+    """
+    Sorted, merged busy intervals with O(log n) overlap checks.
+    """
+
+    def __init__(self, intervals, time_min=None, time_max=None):
+        merged = []
+        for start, end in sorted(intervals):
+            if merged and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        self.starts = [s for s, _ in merged]
+        self.ends = [e for _, e in merged]
+        self.time_min = time_min
+        self.time_max = time_max
+
+    @classmethod
+    def from_freebusy(cls, busy, time_min=None, time_max=None):
+        return cls(
+            [(parse_rfc3339(b["start"]), parse_rfc3339(b["end"])) for b in busy],
+            time_min, time_max
+        )
+
+    def covers(self, start, end):
+        """
+        True if [start, end) lies inside the window this index was fetched for.
+        """
+        return (self.time_min is None or self.time_min <= start) and \
+               (self.time_max is None or end <= self.time_max)
+
+    def is_free(self, start, end):
+        # The only interval that can overlap is the last one starting before `end`
+        i = bisect_left(self.starts, end) - 1
+        return i < 0 or self.ends[i] <= start
+
+
+def fetch_busy_index(service, time_min, time_max, timezone=None):
+    """
+    Build a BusyIndex from a single freebusy().query over [time_min, time_max).
+    """
+    body = {
+        "timeMin": time_min.isoformat(),
+        "timeMax": time_max.isoformat(),
+        "items": [{"id": "primary"}]
+    }
+    if timezone:
+        body["timeZone"] = timezone
+    result = service.freebusy().query(body=body).execute()
+    busy = result["calendars"]["primary"]["busy"]
+    return BusyIndex.from_freebusy(busy, time_min, time_max)
+
+
+def search_window(preferred_start, now=None):
+    """
+    The [time_min, time_max) range searched for alternatives around a requested start.
+    """
+    tz = preferred_start.tzinfo
+    now = now or datetime.now(tz)
+    day = preferred_start.replace(hour=0, minute=0, second=0, microsecond=0)
+    time_min = max(day - timedelta(days=1), now)
+    time_max = day + timedelta(days=SLOT_SEARCH_DAYS + 1)
+    return time_min, time_max
+
+
+def find_free_slots(index, preferred_start, duration, count=2, now=None):
+    """
+    Return up to `count` non-overlapping free (start, end) slots of `duration`
+    within working hours, nearest to `preferred_start` first.
+    """
+    tz = preferred_start.tzinfo
+    now = now or datetime.now(tz)
+    time_min, time_max = search_window(preferred_start, now)
+    step = timedelta(minutes=SLOT_STEP_MINUTES)
+
+    candidates = []
+    day = time_min.replace(hour=0, minute=0, second=0, microsecond=0)
+    while day < time_max:
+        if not (SKIP_WEEKENDS and day.weekday() >= 5):
+            slot = day.replace(hour=WORK_START_HOUR)
+            day_end = day.replace(hour=WORK_END_HOUR)
+            while slot + duration <= day_end:
+                if slot >= now and slot != preferred_start and slot + duration <= time_max:
+                    candidates.append(slot)
+                slot += step
+        day += timedelta(days=1)
+
+    candidates.sort(key=lambda s: abs(s - preferred_start))
+    chosen = []
+    for start in candidates:
+        end = start + duration
+        if not index.is_free(start, end):
+            continue
+        if any(start < c_end and c_start < end for c_start, c_end in chosen):
+            continue
+        chosen.append((start, end))
+        if len(chosen) == count:
+            break
+    return sorted(chosen)
+
+
+def format_slot(start, end):
+    return {"date": start.strftime("%Y-%m-%d"), "start": start.strftime("%H:%M"), "end": end.strftime("%H:%M")}
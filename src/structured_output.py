@@ -0,0 +1,297 @@
+import json
+import os
+import re
+import threading
+from collections import Counter, defaultdict
+from datetime import datetime
+
+# Send JSON-schema response formats with each request (needs a model that supports them)
+LLM_STRUCTURED_OUTPUT = os.getenv("LLM_STRUCTURED_OUTPUT", "0") == "1"
+
+EVENT_PROPERTIES = {
+    "title": {"type": "string"},
+    "date": {"type": "string", "description": "YYYY-MM-DD"},
+    "start": {"type": "string", "description": "HH:MM, 24-hour"},
+    "end": {"type": "string", "description": "HH:MM, 24-hour"}
+}
+# An empty object means "no meeting found"
+EVENT_SCHEMA = {"type": "object", "properties": EVENT_PROPERTIES}
+EVENT_BATCH_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "items": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {"id": {"type": "string"}, "event": EVENT_SCHEMA},
+                "required": ["id", "event"]
+            }
+        }
+    },
+    "required": ["items"]
+}
+CONFIRMATION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "selected": {
+            "anyOf": [
+                {"type": "object", "properties": EVENT_PROPERTIES, "required": ["date", "start", "end"]},
+                {"type": "null"}
+            ]
+        }
+    },
+    "required": ["selected"]
+}
+REQUIRED_EVENT_FIELDS = ("title", "date", "start", "end")
+
+DATE_FORMATS = ["%Y-%m-%d", "%Y/%m/%d", "%m/%d/%Y", "%B %d, %Y", "%B %d %Y", "%b %d, %Y", "%b %d %Y",
+                "%d %B %Y", "%d %b %Y", "%A, %B %d, %Y"]
+TIME_RE = re.compile(r"^(\d{1,2})(?:[:.h](\d{2}))?(?::\d{2})?\s*([ap])?\.?\s*m?\.?$", re.IGNORECASE)
+FENCE_RE = re.compile(r"```(?:json|JSON)?\s*(.*?)```", re.DOTALL)
+TRAILING_COMMA_RE = re.compile(r",\s*([}\]])")
+PY_LITERALS = {"True": "true", "False": "false", "None": "null"}
+SMART_QUOTES = str.maketrans({"“": '"', "”": '"', "‘": "'", "’": "'"})
+
+_stats = defaultdict(Counter)
+_lock = threading.Lock()
+
+
+def _count(kind, outcome):
+    with _lock:
+        _stats[kind][outcome] += 1
+
+
+def response_format(name, schema):
+    """
+    Extra completion kwargs asking for `schema` as the response format, or {} when disabled.
+    """
+    if not LLM_STRUCTURED_OUTPUT:
+        return {}
+    return {"response_format": {"type": "json_schema", "json_schema": {"name": name, "schema": schema}}}
+
+
+def _balanced_slice(text):
+    """
+    Return the first complete {...} or [...] block in `text`, ignoring brackets inside strings.
+    """
+    start = next((i for i, c in enumerate(text) if c in "{["), None)
+    if start is None:
+        return None
+    depth, in_string, escaped = 0, False, False
+    for i in range(start, len(text)):
+        c = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif c == "\\":
+                escaped = True
+            elif c == '"':
+                in_string = False
+        elif c == '"':
+            in_string = True
+        elif c in "{[":
+            depth += 1
+        elif c in "}]":
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    # Truncated output: close whatever is still open
+    return text[start:]
+
+
+def _close_truncated(text):
+    stack = []
+    in_string, escaped = False, False
+    for c in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif c == "\\":
+                escaped = True
+            elif c == '"':
+                in_string = False
+        elif c == '"':
+            in_string = True
+        elif c in "{[":
+            stack.append("}" if c == "{" else "]")
+        elif c in "}]" and stack:
+            stack.pop()
+    return text + ('"' if in_string else "") + "".join(reversed(stack))
+
+
+def _fix_tokens(text):
+    text = text.translate(SMART_QUOTES)
+    if '"' not in text and "'" in text:
+        text = text.replace("'", '"')
+    text = re.sub(r"([:\[,]\s*)(True|False|None)\b", lambda m: m.group(1) + PY_LITERALS[m.group(2)], text)
+    return TRAILING_COMMA_RE.sub(r"\1", text)
+
+
+def repair_json(text):
+    """
+    Parse near-JSON LLM output without another model call. Handles markdown
+    fences, leading/trailing prose, smart or single quotes, Python literals,
+    trailing commas and truncated closers.
+
+    Returns (value, repaired); raises ValueError if nothing usable is found.
+    """
+    if text is None:
+        raise ValueError("Empty LLM output")
+    text = text.strip()
+    try:
+        return json.loads(text), False
+    except json.JSONDecodeError:
+        pass
+
+    fenced = FENCE_RE.search(text)
+    candidate = fenced.group(1).strip() if fenced else text
+    if candidate.lower() in ("null", "none"):
+        return None, True
+    block = _balanced_slice(candidate)
+    if block is None:
+        raise ValueError("No JSON object found in LLM output")
+    for attempt in (block, _fix_tokens(block), _close_truncated(_fix_tokens(block))):
+        try:
+            return json.loads(attempt), True
+        except json.JSONDecodeError:
+            continue
+    raise ValueError("Could not repair LLM output")
+
+
+def normalize_date(value):
+    """
+    Return `value` as YYYY-MM-DD, or None if it is not a recognizable date.
+    """
+    value = str(value).strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).strftime("%Y-%m-%d")
+        except ValueError:
+            continue
+    return None
+
+
+def normalize_time(value):
+    """
+    Return `value` as 24-hour HH:MM ("3pm", "3:30 PM", "15:00:00" ...), or None.
+    """
+    match = TIME_RE.match(str(value).strip())
+    if not match:
+        return None
+    hour, minute, meridiem = int(match.group(1)), int(match.group(2) or 0), (match.group(3) or "").lower()
+    if meridiem:
+        if not 1 <= hour <= 12:
+            return None
+        hour = hour % 12 + (12 if meridiem == "p" else 0)
+    if hour > 23 or minute > 59:
+        return None
+    return f"{hour:02d}:{minute:02d}"
+
+
+def normalize_event(event, required=REQUIRED_EVENT_FIELDS):
+    """
+    Validate an event object and normalize its date/times. Returns {} for an
+    empty object ("no meeting"), the normalized event, or None if invalid.
+    """
+    if not isinstance(event, dict):
+        return None
+    if not event:
+        return {}
+    if any(not isinstance(event.get(k), str) or not event[k].strip() for k in required):
+        return None
+    normalized = dict(event)
+    if "title" in event:
+        normalized["title"] = event["title"].strip()
+    normalized["date"] = normalize_date(event["date"])
+    normalized["start"] = normalize_time(event["start"])
+    normalized["end"] = normalize_time(event["end"])
+    if None in (normalized["date"], normalized["start"], normalized["end"]):
+        return None
+    return normalized
+
+
+def _load(kind, text):
+    try:
+        value, repaired = repair_json(text)
+    except ValueError:
+        _count(kind, "invalid_json")
+        raise
+    if repaired:
+        _count(kind, "repaired")
+    return value
+
+
+def parse_event_output(text):
+    """
+    Validate a parse_event reply. Returns the normalized event, {} when no
+    meeting was found, or None when the output is unusable.
+    """
+    try:
+        value = _load("event", text)
+    except ValueError:
+        return None
+    event = normalize_event(value)
+    _count("event", "failed" if event is None else "ok")
+    return event
+
+
+def parse_event_batch_output(text, expected_ids):
+    """
+    Validate a batched extraction reply (a JSON array, or {"items": [...]}).
+    Returns {msg_id: event} for the elements that pass; the rest are left out.
+    """
+    try:
+        value = _load("event_batch", text)
+    except ValueError:
+        return {}
+    if isinstance(value, dict):
+        value = value.get("items")
+    if not isinstance(value, list):
+        _count("event_batch", "failed")
+        return {}
+    valid = {}
+    for item in value:
+        if not isinstance(item, dict) or str(item.get("id")) not in expected_ids:
+            continue
+        event = normalize_event(item.get("event"))
+        if event is not None:
+            valid[str(item["id"])] = event
+    _count("event_batch", "ok" if len(valid) == len(expected_ids) else "partial")
+    return valid
+
+
+def parse_confirmation_output(text, options):
+    """
+    Validate a confirmation-reply choice against the offered options, matching
+    on normalized date/start. Returns the chosen option from `options`, or None.
+    """
+    try:
+        value = _load("confirmation", text)
+    except ValueError:
+        return None
+    if isinstance(value, dict) and "selected" in value:
+        value = value["selected"]
+    if value is None:
+        _count("confirmation", "no_match")
+        return None
+    choice = normalize_event(value, required=("date", "start", "end"))
+    if choice:
+        for option in options:
+            if normalize_date(option["date"]) == choice["date"] and normalize_time(option["start"]) == choice["start"]:
+                _count("confirmation", "ok")
+                return option
+    _count("confirmation", "failed")
+    return None
+
+
+def get_output_stats():
+    """
+    Per-output-kind counts plus repair and failure rates.
+    """
+    with _lock:
+        stats = {kind: dict(counts) for kind, counts in _stats.items()}
+    for counts in stats.values():
+        total = sum(n for outcome, n in counts.items() if outcome != "repaired")
+        counts["repair_rate"] = counts.get("repaired", 0) / total if total else 0.0
+        counts["failure_rate"] = (counts.get("failed", 0) + counts.get("invalid_json", 0)) / total if total else 0.0
+    return stats
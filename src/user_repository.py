@@ -0,0 +1,248 @@
+import copy
+import os
+import threading
+import time
+from firebase_utils import get_firestore
+
+USER_DOC_CACHE_TTL = float(os.getenv("USER_DOC_CACHE_TTL", "30"))
+USER_DOC_CACHE_SIZE = int(os.getenv("USER_DOC_CACHE_SIZE", "5000"))
+# Users with a document listener are kept current by Firestore and never expire; cap how many
+USER_DOC_MAX_LISTENERS = int(os.getenv("USER_DOC_MAX_LISTENERS", "200"))
+
+ALL_FIELDS = None
+
+
+def _covers(cached_fields, field):
+    if cached_fields is ALL_FIELDS:
+        return True
+    return any(field == f or field.startswith(f + ".") for f in cached_fields)
+
+
+def _set_path(data, path, value):
+    *parents, leaf = path.split(".")
+    for key in parents:
+        child = data.get(key)
+        if not isinstance(child, dict):
+            child = data[key] = {}
+        data = child
+    data[leaf] = value
+
+
+def _get_path(data, path):
+    for key in path.split("."):
+        if not isinstance(data, dict) or key not in data:
+            return None
+        data = data[key]
+    return data
+
+
+def _project(data, fields):
+    if fields is ALL_FIELDS:
+        return copy.deepcopy(data)
+    projected = {}
+    for field in fields:
+        value = _get_path(data, field)
+        if value is not None:
+            _set_path(projected, field, copy.deepcopy(value))
+    return projected
+
+
+class _Entry:
+    def __init__(self, data, fields, exists):
+        self.data = data
+        self.fields = fields
+        self.exists = exists
+        self.fetched_at = time.monotonic()
+        self.watched = False
+
+
+class _Pending:
+    def __init__(self):
+        self.event = threading.Event()
+        self.entry = None
+        self.error = None
+
+
+class UserRepository:
+    """
+    Read-through cache for users/{uid} documents.
+
+    Reads ask only for the fields they need (a Firestore field mask), are
+    served from memory while fresh (USER_DOC_CACHE_TTL) and are coalesced so
+    concurrent misses for one user share a single Firestore read. Users with
+    a document listener (see `watch`) are updated by Firestore as they change;
+    writes made in this process go through `note_write` / `invalidate`.
+    """
+
+    def __init__(self, ttl=USER_DOC_CACHE_TTL, max_size=USER_DOC_CACHE_SIZE, max_listeners=USER_DOC_MAX_LISTENERS):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.max_listeners = max_listeners
+        self._entries = {}
+        self._inflight = {}
+        self._listeners = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "reads": 0, "coalesced": 0, "listener_updates": 0}
+
+    def _fresh(self, entry):
+        return entry.watched or time.monotonic() - entry.fetched_at < self.ttl
+
+    def _lookup(self, uid, fields):
+        entry = self._entries.get(uid)
+        if entry is None or not self._fresh(entry):
+            return None
+        if not entry.exists or (fields is ALL_FIELDS and entry.fields is ALL_FIELDS) or \
+                (fields is not ALL_FIELDS and all(_covers(entry.fields, f) for f in fields)):
+            return entry
+        return None
+
+    def _store(self, uid, entry):
+        current = self._entries.get(uid)
+        if current is not None and current.watched:
+            return
+        if current is not None and entry.exists and current.exists and self._fresh(current) \
+                and entry.fields is not ALL_FIELDS:
+            # Merge a partial read into the entry we already have
+            for field in entry.fields:
+                _set_path(current.data, field, _get_path(entry.data, field))
+            if current.fields is not ALL_FIELDS:
+                current.fields = current.fields | entry.fields
+            return
+        if uid not in self._entries and len(self._entries) >= self.max_size:
+            for old_uid in [u for u, e in self._entries.items() if not e.watched][:max(1, self.max_size // 10)]:
+                del self._entries[old_uid]
+        self._entries[uid] = entry
+
+    def _read(self, uid, fields):
+        ref = get_firestore().collection("users").document(uid)
+        doc = ref.get(field_paths=list(fields)) if fields is not ALL_FIELDS else ref.get()
+        return _Entry((doc.to_dict() or {}) if doc.exists else {}, fields, doc.exists)
+
+    def get(self, uid, fields=ALL_FIELDS):
+        """
+        Return the user's document projected to `fields` (dotted paths allowed;
+        missing fields are left out), or None if the document does not exist.
+        """
+        fields = frozenset(fields) if fields is not ALL_FIELDS else ALL_FIELDS
+        key = (uid, fields)
+        with self._lock:
+            entry = self._lookup(uid, fields)
+            if entry is not None:
+                self._stats["hits"] += 1
+                return _project(entry.data, fields) if entry.exists else None
+            pending = self._inflight.get(key)
+            leader = pending is None
+            if leader:
+                pending = self._inflight[key] = _Pending()
+                self._stats["reads"] += 1
+            else:
+                self._stats["coalesced"] += 1
+
+        if leader:
+            try:
+                pending.entry = self._read(uid, fields)
+                with self._lock:
+                    self._store(uid, pending.entry)
+            except Exception as e:
+                pending.error = e
+            finally:
+                with self._lock:
+                    self._inflight.pop(key, None)
+                pending.event.set()
+        else:
+            pending.event.wait()
+
+        if pending.error is not None:
+            raise pending.error
+        return _project(pending.entry.data, fields) if pending.entry.exists else None
+
+    def exists(self, uid):
+        return self.get(uid, []) is not None
+
+    def note_write(self, uid, updates):
+        """
+        Apply a merge write made by this process to the cached copy, keyed by
+        field path as in DocumentReference.update / set(merge=True).
+        """
+        with self._lock:
+            entry = self._entries.get(uid)
+            if entry is None or not entry.exists:
+                self._entries.pop(uid, None)
+                return
+            for path, value in updates.items():
+                if not isinstance(value, (str, int, float, bool, list, dict, type(None))):
+                    # Sentinels (DELETE_FIELD, Increment, ...) can't be applied locally
+                    self._entries.pop(uid, None)
+                    return
+                _set_path(entry.data, path, copy.deepcopy(value))
+
+    def invalidate(self, uid):
+        with self._lock:
+            entry = self._entries.get(uid)
+            if entry is not None and not entry.watched:
+                del self._entries[uid]
+
+    # ---- listeners ----
+
+    def _on_snapshot(self, uid, docs, changes, read_time):
+        doc = docs[0] if docs else None
+        exists = doc is not None and doc.exists
+        entry = _Entry((doc.to_dict() or {}) if exists else {}, ALL_FIELDS, exists)
+        entry.watched = True
+        with self._lock:
+            if uid not in self._listeners:
+                return
+            self._entries[uid] = entry
+            self._stats["listener_updates"] += 1
+
+    def watch(self, uid):
+        """
+        Keep the user's cached document current with a Firestore listener, if
+        under USER_DOC_MAX_LISTENERS. Returns True when a listener is active.
+        """
+        with self._lock:
+            if uid in self._listeners:
+                return True
+            if len(self._listeners) >= self.max_listeners:
+                return False
+            self._listeners[uid] = None
+        try:
+            ref = get_firestore().collection("users").document(uid)
+            watch = ref.on_snapshot(lambda docs, changes, read_time: self._on_snapshot(uid, docs, changes, read_time))
+        except Exception as e:
+            print(f"⚠️ Failed to watch user document {uid}: {e}")
+            with self._lock:
+                self._listeners.pop(uid, None)
+            return False
+        with self._lock:
+            if uid in self._listeners:
+                self._listeners[uid] = watch
+                return True
+        watch.unsubscribe()
+        return False
+
+    def unwatch(self, uid):
+        with self._lock:
+            watch = self._listeners.pop(uid, None)
+            entry = self._entries.get(uid)
+            if entry is not None and entry.watched:
+                del self._entries[uid]
+        if watch is not None:
+            watch.unsubscribe()
+
+    def stats(self):
+        with self._lock:
+            total = self._stats["hits"] + self._stats["reads"] + self._stats["coalesced"]
+            return {
+                **self._stats,
+                "cached": len(self._entries),
+                "listeners": len(self._listeners),
+                "hit_rate": (self._stats["hits"] + self._stats["coalesced"]) / total if total else None
+            }
+
+
+user_repository = UserRepository()
+
+
+def get_user_repository_stats():
+    return user_repository.stats()
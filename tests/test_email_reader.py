@@ -0,0 +1,45 @@
+import base64
+
+import pytest
+
+from email_reader import extract_body
+
+
+def _b64(text):
+    return base64.urlsafe_b64encode(text.encode("utf-8")).decode("ascii")
+
+
+def _plain(text):
+    return {"mimeType": "text/plain", "body": {"data": _b64(text)}}
+
+
+def _html(text):
+    return {"mimeType": "text/html", "body": {"data": _b64(text)}}
+
+
+@pytest.mark.parametrize("payload, expected", [
+    (_plain("From: 2pm to 3pm tomorrow works for a meeting"), "From: 2pm to 3pm tomorrow works for a meeting"),
+    (_plain("Sounds good, option 2.\n\nOn Mon, Oct 19, 2026 at 10:00 AM Alice <a@x.com>\nwrote:\n> 1. ..."),
+     "Sounds good, option 2."),
+    (_plain("Works for me\n\nFrom: Alice <a@x.com>\nSent: Monday\nTo: Bob\nSubject: Sync\n\nold text"),
+     "Works for me"),
+    (_plain("FYI\n-- \nBob\n\n---------- Forwarded message ---------\nFrom: Carol <c@x.com>\n"
+            "Date: Mon, Oct 19, 2026\nSubject: Planning\nTo: Bob <b@x.com>\n\nCan we meet Oct 21 at 3pm?"),
+     "FYI\nCan we meet Oct 21 at 3pm?"),
+    (_html('<div>Option 1 please</div><div class="gmail_quote"><div>1. 2026-10-20 10:00</div>'
+           '2. 2026-10-21 11:00 old quoted</div>'),
+     "Option 1 please"),
+    (_html('<div>See below</div><div class="gmail_quote"><div class="gmail_attr">'
+           '---------- Forwarded message ---------<br>From: Carol<br>Subject: Sync<br></div>'
+           '<div>Lunch on Oct 22 at noon?</div></div>'),
+     "See below\n\nLunch on Oct 22 at noon?"),
+    # Inline reply: text after a quote whose <p>/<li> are closed implicitly is kept
+    (_html('<div>Reply</div><blockquote><p>old<p>old2</blockquote><div>Meet at 3pm tomorrow</div>'),
+     "Reply\nMeet at 3pm tomorrow"),
+    (_html('<div>Answers inline:</div><div class="gmail_quote"><ul><li>Tuesday?<li>Room?</ul>'
+           '<div>nested</div></div><div>Tuesday at 2pm works, room B</div>'),
+     "Answers inline:\nTuesday at 2pm works, room B"),
+    ({"mimeType": "multipart/mixed", "parts": []}, "No message body found"),
+])
+def test_extract_body(payload, expected):
+    assert extract_body(payload) == expected
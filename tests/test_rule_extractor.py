@@ -0,0 +1,58 @@
+from datetime import datetime
+
+import pytest
+
+from rule_extractor import classify_email
+
+NOW = datetime(2026, 10, 18, 10, 0)  # a Sunday
+
+
+@pytest.mark.parametrize("text, expected", [
+    # Words that merely start with a month abbreviation are not dates
+    ("Let's have a meeting at 3pm to review the 2 marketing plans", "llm"),
+    ("Quick call at 4pm about the summary 3 items", "llm"),
+    ("Let's sync at 2pm, I have 5 junior engineers joining", "llm"),
+    ("Can we decide on the 4 options at 10am? Happy to discuss.", "llm"),
+    # Lower-case "may" is the verb, not the month
+    ("You may 3 times review the doc at 4pm", "llm"),
+    # Cancellations, declines and reschedules never become new invites
+    ("Sorry, I need to cancel our meeting tomorrow at 3pm.", "llm"),
+    ("I can't make the call tomorrow at 3pm, can we move it?", "llm"),
+    ("Reminder: the review meeting on Oct 20 at 3pm has been cancelled.", "llm"),
+    ("I won't be able to join the sync on Oct 20 at 3pm", "llm"),
+    ("Unable to attend the interview tomorrow at 11am", "llm"),
+    ("Let's reschedule the demo to Oct 21 at 2pm", "llm"),
+    ("The standup is moved to tomorrow at 9:30", "llm"),
+    ("We need to postpone lunch until Oct 22 at noon", "llm"),
+    ("I'm not available for the call tomorrow at 4pm", "llm"),
+    # A date alone is enough to ask the LLM
+    ("Are you free Friday to chat?", "llm"),
+    ("How about Oct 20?", "llm"),
+    # Nothing schedulable
+    ("Thanks for the update, looks good.", "skip"),
+    ("Your receipt is attached. Unsubscribe here.", "skip"),
+])
+def test_classify_path(text, expected):
+    assert classify_email(text, now=NOW)[0] == expected
+
+
+@pytest.mark.parametrize("text, event", [
+    ("Let's have a meeting on Oct 20 at 3pm",
+     {"title": "Meeting", "date": "2026-10-20", "start": "15:00", "end": "16:00"}),
+    ("Quick call on 21st October from 2-3pm?",
+     {"title": "Call", "date": "2026-10-21", "start": "14:00", "end": "15:00"}),
+    ("Can we sync on Sept. 3 at 09:30",
+     {"title": "Sync", "date": "2027-09-03", "start": "09:30", "end": "10:30"}),
+    ("Catch up tomorrow at 11am?",
+     {"title": "Catch Up", "date": "2026-10-19", "start": "11:00", "end": "12:00"}),
+    ("Meeting on May 3 at 4pm",
+     {"title": "Meeting", "date": "2027-05-03", "start": "16:00", "end": "17:00"}),
+    ("Lunch on 5 June 2027 at noon",
+     {"title": "Lunch", "date": "2027-06-05", "start": "12:00", "end": "13:00"}),
+])
+def test_rule_events(text, event):
+    assert classify_email(text, now=NOW) == ("rule", event)
+
+
+def test_past_time_today_goes_to_llm():
+    assert classify_email("Meeting today at 9am", now=NOW)[0] == "llm"